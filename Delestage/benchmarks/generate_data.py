@@ -0,0 +1,84 @@
+"""Generate synthetic delestage files for the benchmarks.
+
+Files are named <32 hex ticket id>_<YYYY-MM-DD>.csv and carry the header
+expected by the precheck. A share of the lines, given by the error rate,
+is made invalid the way real files are: missing CP or CI, bad timestamps
+and wrong number of fields.
+
+Usage, from the Delestage directory:
+    python benchmarks/generate_data.py --rows 100000 --error-rate 0.01 --directory /tmp/delestage-data
+"""
+import argparse
+import datetime
+import os
+import random
+import uuid
+
+HEADER = "Depart;Commune;cp;ci;heure_debut;heure_fin"
+TIMESTAMP_FORMAT = "%d/%m/%Y %H:%M"
+
+
+def valid_line(rng, day):
+    """Return a valid data line, CP and CI are not always zero padded like in real files."""
+    depart = rng.randint(1, 95)
+    cp = str(depart * 1000 + rng.randint(0, 999))
+    ci = str(depart * 1000 + rng.randint(1, 999))
+    start = day + datetime.timedelta(minutes=15 * rng.randint(0, 80))
+    end = start + datetime.timedelta(minutes=15 * rng.randint(1, 16))
+    return (
+        f"{depart:02d};Commune {ci};{cp};{ci};"
+        f"{start.strftime(TIMESTAMP_FORMAT)};{end.strftime(TIMESTAMP_FORMAT)}"
+    )
+
+
+def invalid_line(rng, day):
+    """Return a line the validation skips."""
+    fields = valid_line(rng, day).split(';')
+    error = rng.choice(('missing_cp', 'missing_ci', 'bad_timestamp', 'missing_field', 'extra_field'))
+    if error == 'missing_cp':
+        fields[2] = ''
+    elif error == 'missing_ci':
+        fields[3] = ''
+    elif error == 'bad_timestamp':
+        fields[4] = fields[4].replace('/', '-')
+    elif error == 'missing_field':
+        fields.pop()
+    else:
+        fields.append('')
+    return ';'.join(fields)
+
+
+def generate_file(directory, rows, error_rate=0.0, date=None, seed=None):
+    """Write a delestage file of rows data lines and return its path."""
+    rng = random.Random(seed)
+    date = date or datetime.date.today()
+    day = datetime.datetime.combine(date, datetime.time())
+    ticket_id = uuid.UUID(int=rng.getrandbits(128)).hex
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f"{ticket_id}_{date.isoformat()}.csv")
+    with open(path, 'w') as data_file:
+        data_file.write(HEADER + '\n')
+        for _ in range(rows):
+            line = invalid_line(rng, day) if rng.random() < error_rate else valid_line(rng, day)
+            data_file.write(line + '\n')
+    return path
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=10000, help="data lines per file")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="share of invalid lines, from 0 to 1")
+    parser.add_argument('--files', type=int, default=1, help="number of files")
+    parser.add_argument('--date', type=datetime.date.fromisoformat, default=None,
+                        help="date of the files, YYYY-MM-DD, today by default")
+    parser.add_argument('--directory', default='data', help="directory to write the files to")
+    parser.add_argument('--seed', type=int, default=None, help="seed for reproducible files")
+    args = parser.parse_args()
+
+    for index in range(args.files):
+        seed = None if args.seed is None else args.seed + index
+        print(generate_file(args.directory, args.rows, args.error_rate, args.date, seed))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,155 @@
+"""Measure how the validation and the load scale with the size of the files.
+
+For each size, a synthetic file is generated with generate_data.py, then
+validated and loaded into a local PostgreSQL with the load method of
+config.ini. Each size runs in its own process so that its peak RSS is not
+hidden by a bigger one. The rows/sec, the peak RSS and the time of each
+stage are written to a JSON file, to compare versions with --baseline.
+
+The database must be a throwaway one: the content of cp_insee_delestage
+is replaced.
+
+Usage, from the Delestage directory:
+    createdb delestage_bench
+    python benchmarks/pipeline_benchmark.py --dsn dbname=delestage_bench --rows 10000 100000 --error-rate 0.01
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from generate_data import generate_file
+
+DELESTAGE_DIRECTORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, DELESTAGE_DIRECTORY)
+
+
+def stage(seconds, rows):
+    """Describe the timing of a stage."""
+    return {
+        'seconds': round(seconds, 4),
+        'rows_per_second': round(rows / seconds) if seconds else None,
+    }
+
+
+def run_case(rows, error_rate, dsn, seed):
+    """Generate, validate and load one file, in a fresh process."""
+    # config.ini is read from the working directory when delestage is imported
+    os.chdir(DELESTAGE_DIRECTORY)
+    import psycopg2
+    from delestage.config import MERGE_WINDOWS
+    from delestage.db import PooledConnection
+    from delestage.loader import load_rows
+    from delestage.shards import iter_sharded_rows
+    from delestage.validation import merge_windows
+
+    result = {'rows': rows, 'error_rate': error_rate, 'stages': {}}
+    with tempfile.TemporaryDirectory(prefix='delestage-bench-') as work_directory:
+        # The skipped lines files are written to the working directory
+        os.chdir(work_directory)
+        start = time.perf_counter()
+        file_path = generate_file(work_directory, rows, error_rate, seed=seed)
+        result['stages']['generate'] = stage(time.perf_counter() - start, rows)
+
+        # The rows are kept in memory between the stages to time them separately
+        stats = {}
+        start = time.perf_counter()
+        # Same reader as the pipeline, in parallel processes per [Import] validation_workers
+        valid_rows = list(iter_sharded_rows(file_path, stats))
+        result['stages']['validate'] = stage(time.perf_counter() - start, stats['read'])
+        result.update(valid=stats['valid'], skipped=stats['skipped'])
+        if MERGE_WINDOWS:
+            start = time.perf_counter()
+            valid_rows = merge_windows(valid_rows, stats)
+            result['stages']['merge'] = stage(time.perf_counter() - start, stats['valid'])
+            result['merged'] = stats['merged']
+
+        if dsn:
+            # The row method keeps its prepared INSERT on the connection, like pooled ones
+            conn = psycopg2.connect(dsn, connection_factory=PooledConnection)
+            try:
+                errors = []
+                start = time.perf_counter()
+                load_result, = load_rows([('Database1', conn)], valid_rows, [errors])
+                result['stages']['load'] = stage(time.perf_counter() - start, load_result['loaded'])
+                result.update(loaded=load_result['loaded'], errors=len(errors))
+            finally:
+                conn.close()
+        os.chdir(DELESTAGE_DIRECTORY)
+
+    # ru_maxrss is in kilobytes on Linux, the children are the validation processes
+    result['peak_rss_mb'] = round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+    result['validation_workers_peak_rss_mb'] = round(resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024, 1)
+    return result
+
+
+def git_revision():
+    """Return the commit the benchmark runs on, if any."""
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=DELESTAGE_DIRECTORY,
+            capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline):
+    """Print the rows/sec change of each stage against a previous results file."""
+    baseline_cases = {(case['rows'], case['error_rate']): case for case in baseline['cases']}
+    for case in results['cases']:
+        baseline_case = baseline_cases.get((case['rows'], case['error_rate']))
+        if baseline_case is None:
+            continue
+        for name, timing in case['stages'].items():
+            previous = baseline_case['stages'].get(name, {}).get('rows_per_second')
+            if timing['rows_per_second'] and previous:
+                change = (timing['rows_per_second'] / previous - 1) * 100
+                print(f"{case['rows']} rows, {name}: {previous} -> {timing['rows_per_second']} rows/s ({change:+.1f}%)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, nargs='+', default=[10000, 100000], help="data lines of each file")
+    parser.add_argument('--error-rate', type=float, default=0.01, help="share of invalid lines, from 0 to 1")
+    parser.add_argument('--dsn', default=os.environ.get('DELESTAGE_BENCH_DSN'),
+                        help="throwaway PostgreSQL database, the load is skipped without it")
+    parser.add_argument('--seed', type=int, default=0, help="seed of the generated files")
+    parser.add_argument('--output', default='benchmark-results.json', help="JSON results file")
+    parser.add_argument('--baseline', help="previous results file to compare with")
+    args = parser.parse_args()
+
+    from delestage.config import BATCH_SIZE, LOAD_METHOD, RELOAD_MODE
+
+    results = {
+        'revision': git_revision(),
+        'python': platform.python_version(),
+        'load_method': LOAD_METHOD,
+        'batch_size': BATCH_SIZE,
+        'reload_mode': RELOAD_MODE,
+        'cases': [],
+    }
+    for rows in args.rows:
+        # Pool processes are daemonic and could not start the validation processes
+        with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn')) as executor:
+            case = executor.submit(run_case, rows, args.error_rate, args.dsn, args.seed).result()
+        results['cases'].append(case)
+        print(json.dumps(case))
+
+    with open(args.output, 'w') as output_file:
+        json.dump(results, output_file, indent=2)
+    print(f"Results written to {args.output}")
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            compare(results, json.load(baseline_file))
+
+
+if __name__ == "__main__":
+    main()
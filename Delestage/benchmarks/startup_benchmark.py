@@ -0,0 +1,62 @@
+"""Compare the start-up cost of one process per file with the in-process pipeline.
+
+The former precheck ran `python --version` and then a new interpreter for
+the import script for every file, each one importing psycopg2 and requests
+and reading config.ini again. The pipeline now pays this cost once.
+
+Usage, from the Delestage directory:
+    python benchmarks/startup_benchmark.py --files 5 --repeat 3
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+DELESTAGE_DIRECTORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+IMPORT_PIPELINE = "import delestage.pipeline, delestage.servicenow, requests"
+
+
+def run_python(*args):
+    """Run a new interpreter in the Delestage directory and wait for it."""
+    subprocess.run(
+        [sys.executable, *args], check=True, cwd=DELESTAGE_DIRECTORY,
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+
+
+def time_subprocess_per_file(files):
+    """Former flow: a version check and an import interpreter per file."""
+    start = time.perf_counter()
+    for _ in range(files):
+        run_python('--version')
+        run_python('-c', IMPORT_PIPELINE)
+    return time.perf_counter() - start
+
+
+def time_in_process():
+    """Current flow: one interpreter importing the pipeline once for all files."""
+    start = time.perf_counter()
+    run_python('-c', IMPORT_PIPELINE)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--files', type=int, default=5, help="number of ticket files to simulate")
+    parser.add_argument('--repeat', type=int, default=3, help="runs per flow, the best one is kept")
+    args = parser.parse_args()
+
+    subprocess_seconds = min(time_subprocess_per_file(args.files) for _ in range(args.repeat))
+    in_process_seconds = min(time_in_process() for _ in range(args.repeat))
+    print(json.dumps({
+        'files': args.files,
+        'subprocess_per_file_seconds': round(subprocess_seconds, 3),
+        'in_process_seconds': round(in_process_seconds, 3),
+        'saved_seconds': round(subprocess_seconds - in_process_seconds, 3),
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
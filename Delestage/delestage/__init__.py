@@ -0,0 +1,15 @@
+"""Load the ServiceNow load shedding (delestage) files into cp_insee_delestage.
+
+The pipeline is split in modules that can be used on their own:
+validation (read and validate a file, shards to validate it in parallel
+processes), loader (load the rows into the databases), report (summary
+report), archive (compressed store and index of the processed files),
+servicenow (ticket closure) and pipeline, which chains them. metrics
+times the stages of a run. schema owns the table and its indexes, and
+query answers whether a CP or CI is under load shedding from an
+in-process cache. watch runs the pipeline as files land in the data
+directory, dryrun runs it without the databases and ServiceNow, and
+batch loads the files of several days or tickets at once. config reads
+config.ini once, on first use. cli is the command line entry point, used
+by CheckScriptDelestage.py and Delestage-Import-ServiceNow.py.
+"""
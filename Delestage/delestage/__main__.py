@@ -0,0 +1,4 @@
+import sys
+from delestage.cli import main
+
+sys.exit(main())
@@ -0,0 +1,169 @@
+import gzip
+import hashlib
+import logging
+import os
+import re
+import shutil
+import sqlite3
+from contextlib import contextmanager
+from datetime import datetime
+from delestage.config import ARCHIVE_COMPRESSION, ARCHIVE_DIRECTORY, ARCHIVE_INDEX
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+ARCHIVE_SCHEMA = [
+    """
+    CREATE TABLE IF NOT EXISTS archived_files (
+        id INTEGER PRIMARY KEY,
+        ticket_id TEXT NOT NULL,
+        file_date TEXT,
+        filename TEXT NOT NULL,
+        status TEXT NOT NULL,
+        rows_read INTEGER,
+        rows_valid INTEGER,
+        rows_skipped INTEGER,
+        rows_merged INTEGER,
+        rows_loaded INTEGER,
+        rows_failed INTEGER,
+        sha256 TEXT NOT NULL,
+        object_path TEXT NOT NULL,
+        archived_at TEXT NOT NULL
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS archived_files_ticket_id ON archived_files (ticket_id)",
+    "CREATE INDEX IF NOT EXISTS archived_files_file_date ON archived_files (file_date)",
+    "CREATE INDEX IF NOT EXISTS archived_files_sha256 ON archived_files (sha256)",
+]
+
+
+def file_hash(file_path):
+    """Return the SHA-256 of a file, read in chunks."""
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as data_file:
+        for chunk in iter(lambda: data_file.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+@contextmanager
+def archive_index():
+    """Open the archive index, committing on success."""
+    os.makedirs(os.path.dirname(ARCHIVE_INDEX) or '.', exist_ok=True)
+    conn = sqlite3.connect(ARCHIVE_INDEX, timeout=30)
+    conn.row_factory = sqlite3.Row
+    try:
+        with conn:
+            for statement in ARCHIVE_SCHEMA:
+                conn.execute(statement)
+            yield conn
+    finally:
+        conn.close()
+
+
+def compression():
+    """Return the compression to use, zstd only when the zstandard package is installed."""
+    if ARCHIVE_COMPRESSION == 'zstd' and zstandard is None:
+        logging.warning("zstandard is not installed, archiving with gzip.")
+        return 'gzip'
+    return ARCHIVE_COMPRESSION
+
+
+def object_path(sha256, extension):
+    """Return where the payload of a given hash is stored, fanned out by its first byte."""
+    return os.path.join(ARCHIVE_DIRECTORY, 'objects', sha256[:2], f"{sha256}.csv.{extension}")
+
+
+def store_object(file_path, sha256):
+    """Store the compressed payload of a file once, and return its path."""
+    for extension in ('zst', 'gz'):
+        existing_path = object_path(sha256, extension)
+        if os.path.exists(existing_path):
+            return existing_path
+    extension = 'zst' if compression() == 'zstd' else 'gz'
+    path = object_path(sha256, extension)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temporary_path = f"{path}.{os.getpid()}.tmp"
+    with open(file_path, 'rb') as data_file:
+        if extension == 'zst':
+            with open(temporary_path, 'wb') as object_file:
+                with zstandard.ZstdCompressor().stream_writer(object_file) as compressed_file:
+                    shutil.copyfileobj(data_file, compressed_file)
+        else:
+            with gzip.open(temporary_path, 'wb') as compressed_file:
+                shutil.copyfileobj(data_file, compressed_file)
+    os.replace(temporary_path, path)
+    return path
+
+
+def archive_file(latest_file, dynamic_id, status, stats, sha256=None):
+    """Archive a processed file in the content-addressed store and index it.
+
+    Identical payloads are stored once. stats gives the rows read, valid,
+    skipped, merged, loaded and failed, sha256 the hash of the file when
+    already known. The file is then removed from the data directory.
+    Returns the path of the stored payload.
+    """
+    sha256 = sha256 or file_hash(latest_file)
+    path = store_object(latest_file, sha256)
+    filename = os.path.basename(latest_file)
+    file_date = re.search(r'_(\d{4}-\d{2}-\d{2})\.csv$', filename)
+    with archive_index() as conn:
+        conn.execute(
+            """
+            INSERT INTO archived_files (
+                ticket_id, file_date, filename, status, rows_read, rows_valid, rows_skipped,
+                rows_merged, rows_loaded, rows_failed, sha256, object_path, archived_at
+            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """,
+            (
+                dynamic_id, file_date.group(1) if file_date else None, filename, status,
+                stats.get('read'), stats.get('valid'), stats.get('skipped'),
+                stats.get('merged'), stats.get('loaded'), stats.get('failed'), sha256, path,
+                datetime.now().isoformat(timespec='seconds')
+            )
+        )
+    os.remove(latest_file)
+    logging.info(f"Archived '{latest_file}' as '{path}'")
+    return path
+
+
+def find_archived_files(ticket_id=None, file_date=None, status=None):
+    """Return the archive entries matching the criteria given, latest first."""
+    conditions = []
+    parameters = []
+    for column, value in (('ticket_id', ticket_id), ('file_date', file_date), ('status', status)):
+        if value is not None:
+            conditions.append(f"{column} = ?")
+            parameters.append(value)
+    query = "SELECT * FROM archived_files"
+    if conditions:
+        query += " WHERE " + " AND ".join(conditions)
+    with archive_index() as conn:
+        return [dict(row) for row in conn.execute(query + " ORDER BY id DESC", parameters)]
+
+
+def restore_file(ticket_id, directory):
+    """Decompress the last archived file of a ticket into directory, under its original name.
+
+    Returns the restored path, or None when the ticket was never archived.
+    """
+    entries = find_archived_files(ticket_id=ticket_id)
+    if not entries:
+        return None
+    entry = entries[0]
+    restored_path = os.path.join(directory, entry['filename'])
+    with open(restored_path, 'wb') as restored_file:
+        if entry['object_path'].endswith('.zst'):
+            if zstandard is None:
+                raise RuntimeError(f"zstandard is needed to restore {entry['object_path']}")
+            with open(entry['object_path'], 'rb') as object_file:
+                with zstandard.ZstdDecompressor().stream_reader(object_file) as compressed_file:
+                    shutil.copyfileobj(compressed_file, restored_file)
+        else:
+            with gzip.open(entry['object_path'], 'rb') as compressed_file:
+                shutil.copyfileobj(compressed_file, restored_file)
+    logging.info(f"Restored '{restored_path}' from '{entry['object_path']}'")
+    return restored_path
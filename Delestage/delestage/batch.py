@@ -0,0 +1,263 @@
+import glob
+import logging
+import os
+import re
+import time
+from collections import Counter, defaultdict
+from datetime import datetime
+from delestage import archive, report
+from delestage.config import DATA_DIRECTORY, MERGE_WINDOWS, RELOAD_MODE, databases
+from delestage.db import close_pools, get_connection, release_connection
+from delestage.loader import load_rows, row_key
+from delestage.metrics import run_metrics, timed_rows
+from delestage.pipeline import prepare_directories, ticket_id
+from delestage.servicenow import close_ticket_on_servicenow, start_outbox_worker
+from delestage.shards import iter_sharded_rows
+from delestage.validation import skipped_lines_paths, sweep_windows
+
+batch_filename_pattern = re.compile(r"^([a-fA-F0-9]{32})_(\d{4}-\d{2}-\d{2})\.csv$")
+
+
+def select_files(from_date=None, to_date=None, tickets=None):
+    """Return the files of the data directory to load in one batch, by date then ticket.
+
+    Files are selected by their date, from_date and to_date included, and,
+    when tickets is given, by ticket. Tickets with no file in the data
+    directory are restored from the archive. A ticket is only loaded from
+    its latest file.
+    """
+    files = {}
+    for file_path in glob.glob(os.path.join(DATA_DIRECTORY, '*.csv')):
+        match = batch_filename_pattern.match(os.path.basename(file_path))
+        if not match:
+            continue
+        snow_id, file_date = match.groups()
+        if (from_date and file_date < from_date) or (to_date and file_date > to_date):
+            continue
+        if tickets and snow_id not in tickets:
+            continue
+        if snow_id in files:
+            logging.warning(f"Ticket {snow_id} has several files, only the latest one is loaded.")
+            if files[snow_id][0] > file_date:
+                continue
+        files[snow_id] = (file_date, file_path)
+    for snow_id in tickets or []:
+        if snow_id not in files:
+            restored_file = archive.restore_file(snow_id, DATA_DIRECTORY)
+            if restored_file is None:
+                logging.error(f"No file for ticket {snow_id} in {DATA_DIRECTORY} or in the archive.")
+                continue
+            files[snow_id] = (batch_filename_pattern.match(os.path.basename(restored_file)).group(2), restored_file)
+    return [file_path for file_date, file_path in sorted(files.values())]
+
+
+def merge_ticket_windows(ticket_rows, stats, overlapping=True):
+    """Merge the windows of several tickets, keeping the tickets each window comes from.
+
+    ticket_rows are (cp, ci, heure_debut, heure_fin, ticket) rows, merged
+    by validation.sweep_windows, only when identical unless overlapping.
+    Returns the merged (cp, ci, heure_debut, heure_fin) rows, sorted, and
+    the set of tickets of each one, and sets stats['merged'] to the number
+    of rows collapsed.
+    """
+    ticket_rows.sort()
+    merged_rows = []
+    provenance = []
+    for window, window_tickets in sweep_windows(ticket_rows, overlapping):
+        merged_rows.append(window)
+        provenance.append(set(window_tickets))
+    stats['merged'] = len(ticket_rows) - len(merged_rows)
+    logging.info(
+        f"Merged {len(ticket_rows)} rows of {len({ticket for tickets in provenance for ticket in tickets})} "
+        f"tickets into {len(merged_rows)} rows."
+    )
+    return merged_rows, provenance
+
+
+class BatchErrorSink:
+    """List-like collector of the insertion errors of one database, recorded in the reports of their tickets.
+
+    An error is reported to every ticket with a window of its (cp, ci),
+    or to every ticket when it concerns the whole load.
+    """
+
+    def __init__(self, report_writers, cp_ci_tickets, error_counts, database):
+        self.report_writers = report_writers
+        self.cp_ci_tickets = cp_ci_tickets
+        self.error_counts = error_counts
+        self.database = database
+        self.count = 0
+
+    def append(self, error_record):
+        self.count += 1
+        tickets = self.cp_ci_tickets.get((error_record['cp'], error_record['ci'])) or self.report_writers
+        for snow_id in tickets:
+            self.report_writers[snow_id].add_error(self.database, error_record)
+            self.error_counts[snow_id] += 1
+
+    def __len__(self):
+        return self.count
+
+
+def process_batch(files, today_date):
+    """Load the files of several tickets at once, then report, archive and close each ticket.
+
+    The valid rows of every file are merged into one dataset, each window
+    remembering the tickets it comes from, and loaded in a single load
+    instead of one full reload per file. Windows are merged as per [Import]
+    merge_windows, otherwise identical windows are only loaded once. Each
+    ticket gets its own summary
+    report, with its rows, and the outcome of the shared load. Returns the
+    final status of each file.
+    """
+    start_time = datetime.now()
+    tickets = {latest_file: ticket_id(latest_file) for latest_file in files}
+    statuses = {latest_file: "KO" for latest_file in files}
+    file_hashes = {}
+    report_contents = {}
+    targets = []
+    try:
+        with run_metrics.span('connection'):
+            targets = [(name, get_connection(name, params)) for name, params in databases]
+        # The other unreachable databases are loaded as failed targets, see load_rows
+        if targets[0][1] is None:
+            return statuses
+
+        file_stats = {}
+        ticket_rows = []
+        for latest_file in files:
+            logging.info(f"Processing file: {latest_file}")
+            file_hashes[latest_file] = archive.file_hash(latest_file)
+            file_stats[latest_file] = {}
+            snow_id = tickets[latest_file]
+            for row in timed_rows(iter_sharded_rows(latest_file, file_stats[latest_file]), 'validation', run_metrics):
+                ticket_rows.append(row + (snow_id,))
+        merge_stats = {}
+        with run_metrics.span('merge'):
+            rows, provenance = merge_ticket_windows(ticket_rows, merge_stats, MERGE_WINDOWS)
+        del ticket_rows
+
+        # Rows loaded are reported as row keys by the diff mode
+        if RELOAD_MODE == 'diff':
+            row_tickets = {row_key(row): window_tickets for row, window_tickets in zip(rows, provenance)}
+        else:
+            row_tickets = dict(zip(rows, provenance))
+        cp_ci_tickets = defaultdict(set)
+        ticket_windows = Counter()
+        for (cp, ci, heure_debut, heure_fin), window_tickets in zip(rows, provenance):
+            cp_ci_tickets[(cp, ci)] |= window_tickets
+            ticket_windows.update(window_tickets)
+
+        report_writers = {snow_id: report.ReportWriter(snow_id) for snow_id in tickets.values()}
+        loaded_counts = Counter()
+        error_counts = Counter()
+
+        def add_loaded(loaded_rows):
+            for row in loaded_rows:
+                for snow_id in row_tickets[row]:
+                    report_writers[snow_id].add_loaded([row])
+                    loaded_counts[snow_id] += 1
+
+        try:
+            results = []
+            load_duration = 0
+            if not rows:
+                # Loading nothing would empty the table, or swap an empty one in
+                logging.error("No valid rows in the batch, the table is left unchanged.")
+            else:
+                load_start = time.perf_counter()
+                results = load_rows(
+                    targets, rows,
+                    [BatchErrorSink(report_writers, cp_ci_tickets, error_counts, name) for name, conn in targets],
+                    add_loaded
+                )
+                load_duration = time.perf_counter() - load_start
+                for report_writer in report_writers.values():
+                    report_writer.settle_loaded(results[0]['committed'])
+            for result in results:
+                run_metrics.add_time('db_delete', result['delete_seconds'], result['database'])
+                run_metrics.add_time('db_load', result['seconds'], result['database'])
+
+            with run_metrics.span('report'):
+                successful_insertions_count, insertion_errors_count = report.collect_results(results)
+                batch_note = (
+                    f"Loaded in one batch of {len(files)} tickets: {len(rows)} rows, "
+                    f"{merge_stats['merged']} windows merged, {successful_insertions_count} loaded, "
+                    f"{insertion_errors_count} errors\n"
+                )
+                if not rows:
+                    batch_note += "No valid rows to load, the table was left unchanged.\n"
+                for latest_file in files:
+                    snow_id = tickets[latest_file]
+                    stats = file_stats[latest_file]
+                    loaded = loaded_counts[snow_id] if results and results[0]['committed'] else 0
+                    merged = stats.get('valid', 0) - ticket_windows[snow_id]
+                    report_writers[snow_id].add_skipped_lines(skipped_lines_paths(snow_id)[1])
+                    report_contents[latest_file] = batch_note + report.build_report(
+                        latest_file, report_writers[snow_id], results, loaded, error_counts[snow_id],
+                        stats.get('skipped', 0), load_duration, merged
+                    )
+                    statuses[latest_file] = report.file_status(loaded, error_counts[snow_id], stats.get('skipped', 0))
+                    file_stats[latest_file] = dict(stats, merged=merged, loaded=loaded, failed=error_counts[snow_id])
+        finally:
+            for report_writer in report_writers.values():
+                report_writer.close()
+        run_metrics.count('valid', sum(stats.get('valid', 0) for stats in file_stats.values()))
+        run_metrics.count('skipped', sum(stats.get('skipped', 0) for stats in file_stats.values()))
+        run_metrics.count('merged', merge_stats['merged'])
+        run_metrics.count('failed', insertion_errors_count)
+        run_metrics.count('loaded', successful_insertions_count)
+
+        with run_metrics.span('archive'):
+            for latest_file in files:
+                archive.archive_file(
+                    latest_file, tickets[latest_file], statuses[latest_file], file_stats[latest_file],
+                    file_hashes[latest_file]
+                )
+
+    except Exception as e:
+        logging.error(f"Error processing the batch: {str(e)}")
+
+    finally:
+        end_time = datetime.now()
+        for latest_file in files:
+            summary_report_path = report.summary_report_path(tickets[latest_file])
+            with open(summary_report_path, "w") as summary_report_file:
+                summary_report_file.write(f"Summary Report for {today_date}\n\n")
+                if latest_file in report_contents:
+                    summary_report_file.write(report_contents[latest_file])
+                    summary_report_file.write("-" * 50 + "\n")
+            report.write_final_status(summary_report_path, statuses[latest_file], start_time, end_time)
+            logging.info(f"Summary report generated and saved to {summary_report_path}")
+            with run_metrics.span('servicenow_queue'):
+                close_ticket_on_servicenow(
+                    tickets[latest_file], summary_report_path, file_hashes.get(latest_file), statuses[latest_file]
+                )
+        for name, conn in targets:
+            if conn is not None:
+                release_connection(name, conn)
+    return statuses
+
+
+def run_batch(from_date=None, to_date=None, tickets=None):
+    """Load the files of a date range, or of a list of tickets, in one batch.
+
+    Dates are YYYY-MM-DD strings, both included. Returns the final status
+    of each file.
+    """
+    prepare_directories()
+    with run_metrics.span('discovery'):
+        files = select_files(from_date, to_date, tickets)
+    if not files:
+        logging.error("No files to load in the batch.")
+        return {}
+    logging.info(f"Loading {len(files)} files in one batch.")
+
+    outbox_worker = start_outbox_worker()
+    statuses = process_batch(files, datetime.now().strftime("%Y-%m-%d"))
+    close_pools()
+    with run_metrics.span('servicenow_flush'):
+        outbox_worker.stop()
+    for latest_file, status in statuses.items():
+        logging.info(f"{latest_file}: {status}")
+    return statuses
@@ -0,0 +1,133 @@
+import json
+import logging
+import os
+import threading
+import psycopg2
+from psycopg2 import sql
+from delestage.archive import file_hash
+from delestage.config import BATCH_SIZE, CHECKPOINT_DIRECTORY, LOAD_METHOD, MERGE_WINDOWS, RELOAD_MODE
+
+
+def checkpoint_settings():
+    """Settings the batches of a file depend on, a checkpoint is only valid with the same ones."""
+    return {
+        'load_method': LOAD_METHOD, 'reload_mode': RELOAD_MODE,
+        'batch_size': BATCH_SIZE, 'merge_windows': MERGE_WINDOWS,
+    }
+
+
+class Checkpoint:
+    """Progress of the load of a file, kept in a local JSON state file.
+
+    For each database, the state records the number of batches committed,
+    the rows loaded and the insertion errors met. A batch is recorded as
+    pending, with the id of its transaction, before its commit and as
+    committed after it, so a rerun after a crash can ask the database
+    whether the pending batch made it. The state file is removed once the
+    file is archived.
+    """
+
+    def __init__(self, file_path, dynamic_id):
+        self.path = os.path.join(CHECKPOINT_DIRECTORY, f"{dynamic_id}.json")
+        self.lock = threading.Lock()
+        fresh_state = {'file': file_path, 'sha256': file_hash(file_path), 'settings': checkpoint_settings(), 'targets': {}}
+        self.state = fresh_state
+        if os.path.exists(self.path):
+            try:
+                with open(self.path) as state_file:
+                    state = json.load(state_file)
+            except (OSError, ValueError) as e:
+                logging.warning(f"Ignoring the unreadable checkpoint {self.path}: {e}")
+                state = None
+            if state and state['sha256'] == fresh_state['sha256'] and state['settings'] == fresh_state['settings']:
+                self.state = state
+            else:
+                logging.info(f"Checkpoint {self.path} is for another file or other settings, starting over.")
+
+    def save(self):
+        """Write the state file at once, and to disk, so it survives a crash."""
+        os.makedirs(CHECKPOINT_DIRECTORY, exist_ok=True)
+        temporary_path = f"{self.path}.tmp"
+        with open(temporary_path, 'w') as state_file:
+            json.dump(self.state, state_file)
+            state_file.flush()
+            os.fsync(state_file.fileno())
+        os.replace(temporary_path, self.path)
+
+    def resume(self, database_name, conn, table):
+        """Return the progress to resume the load of a database from, or None to start over.
+
+        The pending batch counts as committed only when the database reports
+        its transaction as committed, a row count is not enough: in delete
+        mode the first batch also empties the table. The load then resumes
+        when the table holds exactly the rows the state file says were
+        committed.
+        """
+        with self.lock:
+            target = self.state['targets'].get(database_name)
+            self.state['targets'][database_name] = {'batches': 0, 'loaded': 0, 'errors': 0, 'pending': None}
+        if not target or not (target['batches'] or target['pending']):
+            return None
+        pending = target.pop('pending')
+        try:
+            with conn.cursor() as cursor:
+                pending_status = None
+                if pending:
+                    # NULL when the transaction is too old for the database to tell
+                    cursor.execute("SELECT txid_status(%s)", (pending['txid'],))
+                    pending_status, = cursor.fetchone()
+                cursor.execute(sql.SQL("SELECT count(*) FROM {}").format(sql.Identifier(table)))
+                row_count, = cursor.fetchone()
+            conn.commit()
+        except psycopg2.Error as e:
+            conn.rollback()
+            logging.info(f"{database_name}: cannot resume the load, starting over: {e}")
+            return None
+        if pending and pending_status is None:
+            logging.info(f"{database_name}: unknown outcome of batch {pending['batch']}, starting over.")
+            return None
+        if pending_status == 'committed':
+            target.update(
+                batches=pending['batch'], loaded=target['loaded'] + pending['loaded'],
+                errors=target['errors'] + pending['errors']
+            )
+        if not target['batches']:
+            # Nothing of this file is known to be in the table, it may still hold the previous data
+            logging.info(f"{database_name}: no batch was committed, starting over.")
+            return None
+        if row_count != target['loaded']:
+            logging.info(
+                f"{database_name}: {row_count} rows in {table} instead of {target['loaded']}, "
+                "cannot resume the load, starting over."
+            )
+            return None
+        with self.lock:
+            self.state['targets'][database_name] = dict(target, pending=None)
+        logging.info(f"{database_name}: resuming the load after batch {target['batches']}.")
+        return target
+
+    def prepare(self, database_name, conn, batch, loaded, errors):
+        """Record a batch about to be committed in the open transaction of conn."""
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT txid_current()")
+            txid, = cursor.fetchone()
+        with self.lock:
+            self.state['targets'][database_name]['pending'] = {
+                'batch': batch, 'loaded': loaded, 'errors': errors, 'txid': txid
+            }
+            self.save()
+
+    def commit(self, database_name):
+        """Record the pending batch as committed."""
+        with self.lock:
+            target = self.state['targets'][database_name]
+            pending = target['pending']
+            target.update(
+                batches=pending['batch'], loaded=target['loaded'] + pending['loaded'],
+                errors=target['errors'] + pending['errors'], pending=None
+            )
+            self.save()
+
+    def remove(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
@@ -0,0 +1,109 @@
+import argparse
+import logging
+from datetime import date, datetime
+from delestage.config import ConfigError, load_settings
+
+
+def main(argv=None):
+    """Run the precheck and the import of the day's files in one process."""
+    parser = argparse.ArgumentParser(
+        prog='delestage',
+        description="Check and import the ServiceNow load shedding files into cp_insee_delestage."
+    )
+    parser.add_argument(
+        '--no-precheck', action='store_true',
+        help="skip the data directory and database checks"
+    )
+    parser.add_argument(
+        '--drain-outbox', action='store_true',
+        help="only send the ServiceNow ticket updates waiting in the outbox"
+    )
+    parser.add_argument(
+        '--watch', action='store_true',
+        help="keep running and process the files as soon as they land in the data directory"
+    )
+    parser.add_argument(
+        '--history', nargs='?', const='', metavar='TICKET',
+        help="list the archived files, of one ticket when given, and exit"
+    )
+    parser.add_argument(
+        '--rerun', metavar='TICKET',
+        help="import the archived file of a ticket again"
+    )
+    parser.add_argument(
+        '--dry-run', action='store_true',
+        help="validate and report the day's files without connecting to the databases or ServiceNow, "
+             "and print the time each stage takes"
+    )
+    parser.add_argument(
+        '--from-date', metavar='YYYY-MM-DD', type=date.fromisoformat,
+        help="load the files of the data directory from this date in one batch"
+    )
+    parser.add_argument(
+        '--to-date', metavar='YYYY-MM-DD', type=date.fromisoformat,
+        help="load the files of the data directory up to this date in one batch"
+    )
+    parser.add_argument(
+        '--tickets', nargs='+', metavar='TICKET',
+        help="load the files of these tickets in one batch, restored from the archive when no longer "
+             "in the data directory"
+    )
+    args = parser.parse_args(argv)
+
+    # No-op when the calling script already set up logging
+    logging.basicConfig(
+        handlers=[logging.StreamHandler()],
+        level=logging.INFO,
+        format='%(asctime)s - %(levelname)s - %(message)s'
+    )
+
+    try:
+        load_settings()
+    except ConfigError as e:
+        logging.error(str(e))
+        return 2
+
+    # Modules are imported for the mode run only, so --help or --history do
+    # not import psycopg2
+    if args.drain_outbox:
+        from delestage.servicenow import drain_outbox
+        logging.info(f"{drain_outbox()} ServiceNow ticket updates sent.")
+        return 0
+    if args.history is not None:
+        from delestage.archive import find_archived_files
+        for entry in find_archived_files(ticket_id=args.history or None):
+            print(
+                f"{entry['archived_at']} {entry['ticket_id']} {entry['file_date']} {entry['status']}: "
+                f"{entry['rows_read']} read, {entry['rows_skipped']} skipped, {entry['rows_loaded']} loaded, "
+                f"{entry['rows_failed']} failed, {entry['sha256'][:12]}"
+            )
+        return 0
+    if args.dry_run:
+        from delestage.dryrun import run_dry_run
+        run_dry_run()
+        return 0
+
+    from delestage.metrics import write_run_metrics
+    start_time = datetime.now()
+    files = {}
+    if args.rerun:
+        from delestage.pipeline import run_rerun
+        files = run_rerun(args.rerun)
+    elif args.watch:
+        from delestage.watch import run_watch
+        files = run_watch()
+    elif args.from_date or args.to_date or args.tickets:
+        from delestage.batch import run_batch
+        from delestage.precheck import check_databases
+        # The files of the tickets may only be in the archive, see select_files
+        if args.no_precheck or check_databases():
+            files = run_batch(
+                args.from_date and args.from_date.isoformat(), args.to_date and args.to_date.isoformat(), args.tickets
+            )
+    else:
+        from delestage.pipeline import run_import
+        from delestage.precheck import run_precheck
+        if args.no_precheck or run_precheck():
+            files = run_import()
+    write_run_metrics(start_time, files)
+    return 0
@@ -0,0 +1,221 @@
+import configparser
+from dataclasses import dataclass, fields
+from functools import lru_cache
+
+CONFIG_PATH = 'config.ini'
+
+
+class ConfigError(ValueError):
+    """Missing or invalid setting in config.ini."""
+
+
+@dataclass(frozen=True)
+class Settings:
+    """Settings read from config.ini, see load_settings().
+
+    They are also the module constants of delestage.config, named in upper
+    case, e.g. BATCH_SIZE for batch_size, except databases.
+    """
+
+    service_now_username: str
+    service_now_password: str
+    smtp_server: str
+    sender_email: str
+    recipient_email: str
+
+    # (name, connection parameters) of each [DatabaseN] section up to
+    # num_databases. Database1 is the main one.
+    databases: tuple
+
+    # Outcome policy when several databases are loaded: 'all' commits only if
+    # every database loaded, 'independent' commits each database that loaded
+    # and reports the divergence
+    consistency: str
+
+    # Load settings: 'bulk' sends batches of rows in a single transaction,
+    # 'row' keeps the historical one INSERT + commit per row
+    load_method: str
+    batch_size: int
+    # Reload settings: 'delete' empties the live table before loading it,
+    # 'swap' loads a staging table and swaps it with the live one at the end,
+    # 'diff' only deletes and inserts the rows that changed since the last load
+    reload_mode: str
+    # Number of ticket files processed in parallel worker processes
+    workers: int
+    # Merge the duplicate and overlapping windows of each (cp, ci) before
+    # loading, which holds and sorts all the valid rows of a file in memory
+    merge_windows: bool
+    # Processes validating the lines of a file in parallel, by byte ranges of
+    # validation_shard_size bytes (0 = one per CPU, 1 = in the loading process).
+    # Files of a single range are always validated in the loading process.
+    validation_workers: int
+    validation_shard_size: int
+    # Commit each batch and record it in a state file, so that a rerun after a
+    # crash resumes from the last committed batch (bulk delete and swap modes).
+    # Batches are committed on each database separately, so it needs
+    # consistency 'independent' when there are several databases.
+    checkpoint: bool
+    checkpoint_directory: str
+
+    # Directory where the ServiceNow files are dropped
+    data_directory: str
+
+    # Processed files are stored compressed, once per distinct content, under
+    # directory/objects and listed in a SQLite index. compression is gzip, or
+    # zstd when the zstandard package is installed.
+    archive_directory: str
+    archive_compression: str
+    archive_index: str
+
+    # Watch mode: files are detected with inotify, or by polling the data
+    # directory every poll_interval seconds when inotify is off or unavailable.
+    # Files already there at start-up are processed once unchanged for
+    # settle_seconds, files left in the directory by a failed processing
+    # again after retry_delay seconds.
+    watch_inotify: bool
+    watch_poll_interval: float
+    watch_settle_seconds: float
+    watch_retry_delay: float
+
+    # Connection settings shared by the precheck and the import
+    connect_timeout: int
+    # Server-side limit for every statement, in milliseconds (0 = no limit)
+    statement_timeout: int
+    connect_retries: int
+    # Delay before the first retry, in seconds, doubled at each retry
+    retry_delay: float
+    # Maximum number of connections kept open per database
+    pool_size: int
+
+    # ServiceNow ticket updates go through a local outbox drained in the background
+    service_now_url: str
+    service_now_timeout: float
+    service_now_outbox: str
+    service_now_max_attempts: int
+    # Delay before the first retry, in seconds, doubled at each retry
+    service_now_retry_delay: float
+    # Seconds the end of a run waits for the queued updates to be sent
+    service_now_flush_timeout: float
+
+    # Number of rows and errors quoted in the summary report, the full list is
+    # in the compressed details file next to it
+    report_sample_size: int
+
+    # Stage timings and row counters of each run, as JSON run records and a
+    # Prometheus node exporter textfile (empty to disable it)
+    metrics_directory: str
+    metrics_textfile: str
+
+    # Seconds the windows read by delestage.query are kept before being read again
+    query_cache_ttl: float
+
+    def __post_init__(self):
+        problems = []
+        for name, choices in (
+            ('consistency', ('all', 'independent')),
+            ('load_method', ('bulk', 'row')),
+            ('reload_mode', ('delete', 'swap', 'diff')),
+            ('archive_compression', ('gzip', 'zstd')),
+        ):
+            if getattr(self, name) not in choices:
+                problems.append(f"{name} is '{getattr(self, name)}', expected one of {', '.join(choices)}")
+        for name, minimum in (
+            ('batch_size', 1), ('workers', 1), ('validation_workers', 0), ('validation_shard_size', 1),
+            ('connect_timeout', 0), ('statement_timeout', 0), ('connect_retries', 0), ('retry_delay', 0),
+            ('pool_size', 1), ('service_now_timeout', 0), ('service_now_max_attempts', 1),
+            ('service_now_retry_delay', 0), ('service_now_flush_timeout', 0), ('report_sample_size', 0),
+            ('watch_poll_interval', 0), ('watch_settle_seconds', 0), ('watch_retry_delay', 0), ('query_cache_ttl', 0),
+        ):
+            if getattr(self, name) < minimum:
+                problems.append(f"{name} is {getattr(self, name)}, expected at least {minimum}")
+        if not self.databases:
+            problems.append("num_databases is 0, expected at least 1")
+        if self.checkpoint and self.consistency == 'all' and len(self.databases) > 1:
+            problems.append("checkpoint commits each batch per database, it cannot be used with consistency all")
+        if problems:
+            raise ConfigError("Invalid configuration: " + "; ".join(problems))
+
+
+def read_settings(config):
+    """Build the Settings of a parsed config.ini."""
+    databases = []
+    for database_index in range(1, config.getint('General', 'num_databases') + 1):
+        database_section = f'Database{database_index}'
+        databases.append((database_section, {
+            'host': config.get(database_section, 'host'),
+            'database': config.get(database_section, 'database'),
+            'user': config.get(database_section, 'user'),
+            'password': config.get(database_section, 'password'),
+            'port': config.get(database_section, 'port')
+        }))
+
+    return Settings(
+        service_now_username=config['Credentials']['service_now_username'],
+        service_now_password=config['Credentials']['service_now_password'],
+        smtp_server=config['Credentials']['smtp_server'],
+        sender_email=config['Credentials']['sender_email'],
+        recipient_email=config['Credentials']['recipient_email'],
+        databases=tuple(databases),
+        consistency=config.get('General', 'consistency', fallback='all'),
+        load_method=config.get('Import', 'load_method', fallback='bulk'),
+        batch_size=config.getint('Import', 'batch_size', fallback=5000),
+        reload_mode=config.get('Import', 'reload_mode', fallback='delete'),
+        workers=config.getint('Import', 'workers', fallback=1),
+        merge_windows=config.getboolean('Import', 'merge_windows', fallback=False),
+        validation_workers=config.getint('Import', 'validation_workers', fallback=1),
+        validation_shard_size=int(config.getfloat('Import', 'validation_shard_size', fallback=8) * 1024 * 1024),
+        checkpoint=config.getboolean('Import', 'checkpoint', fallback=False),
+        checkpoint_directory=config.get('Import', 'checkpoint_directory', fallback='checkpoints'),
+        data_directory=config.get('Directory', 'data'),
+        archive_directory=config.get('Archive', 'directory', fallback='archive'),
+        archive_compression=config.get('Archive', 'compression', fallback='gzip'),
+        archive_index=config.get('Archive', 'index', fallback='archive/index.sqlite3'),
+        watch_inotify=config.getboolean('Watch', 'inotify', fallback=True),
+        watch_poll_interval=config.getfloat('Watch', 'poll_interval', fallback=2),
+        watch_settle_seconds=config.getfloat('Watch', 'settle_seconds', fallback=5),
+        watch_retry_delay=config.getfloat('Watch', 'retry_delay', fallback=60),
+        connect_timeout=config.getint('Connection', 'connect_timeout', fallback=10),
+        statement_timeout=config.getint('Connection', 'statement_timeout', fallback=600000),
+        connect_retries=config.getint('Connection', 'retries', fallback=3),
+        retry_delay=config.getfloat('Connection', 'retry_delay', fallback=1),
+        pool_size=config.getint('Connection', 'pool_size', fallback=2),
+        service_now_url=config.get('ServiceNow', 'instance_url', fallback='https://odigodev.service-now.com'),
+        service_now_timeout=config.getfloat('ServiceNow', 'timeout', fallback=30),
+        service_now_outbox=config.get('ServiceNow', 'outbox', fallback='servicenow_outbox.sqlite3'),
+        service_now_max_attempts=config.getint('ServiceNow', 'max_attempts', fallback=8),
+        service_now_retry_delay=config.getfloat('ServiceNow', 'retry_delay', fallback=30),
+        service_now_flush_timeout=config.getfloat('ServiceNow', 'flush_timeout', fallback=60),
+        report_sample_size=config.getint('Report', 'sample_size', fallback=20),
+        metrics_directory=config.get('Metrics', 'directory', fallback='metrics'),
+        metrics_textfile=config.get('Metrics', 'textfile', fallback='metrics/delestage.prom'),
+        query_cache_ttl=config.getfloat('Query', 'cache_ttl', fallback=300),
+    )
+
+
+@lru_cache(maxsize=None)
+def load_settings(path=CONFIG_PATH):
+    """Read and validate config.ini, once per process.
+
+    The precheck and the import of a run share the same Settings. Raises
+    ConfigError when the file is missing or a setting is missing or
+    invalid.
+    """
+    config = configparser.ConfigParser()
+    if not config.read(path):
+        raise ConfigError(f"Configuration file {path} not found")
+    try:
+        return read_settings(config)
+    except ConfigError:
+        raise
+    except (configparser.Error, KeyError, ValueError) as e:
+        raise ConfigError(f"Invalid configuration in {path}: {e}") from e
+
+
+SETTING_NAMES = {field.name for field in fields(Settings)}
+
+
+def __getattr__(name):
+    """Return a setting as a module constant, config.ini is only read on first use."""
+    if name == 'databases' or (name.isupper() and name.lower() in SETTING_NAMES):
+        return getattr(load_settings(), name.lower())
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
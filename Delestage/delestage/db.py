@@ -0,0 +1,94 @@
+import logging
+import threading
+import time
+import psycopg2
+import psycopg2.extensions
+import psycopg2.pool
+from delestage.config import CONNECT_RETRIES, CONNECT_TIMEOUT, POOL_SIZE, RETRY_DELAY, STATEMENT_TIMEOUT
+
+# One pool per database name, shared by the precheck and the import
+pools = {}
+pools_lock = threading.Lock()
+
+
+class PooledConnection(psycopg2.extensions.connection):
+    """Connection remembering the statements prepared in its session."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.prepared_statements = set()
+
+
+def get_pool(database_name, db_params):
+    """Return the connection pool of a database, creating it on first use."""
+    with pools_lock:
+        if database_name not in pools:
+            pools[database_name] = psycopg2.pool.ThreadedConnectionPool(
+                0, POOL_SIZE,
+                connection_factory=PooledConnection,
+                connect_timeout=CONNECT_TIMEOUT,
+                options=f'-c statement_timeout={STATEMENT_TIMEOUT}',
+                **db_params
+            )
+        return pools[database_name]
+
+
+def check_connection(conn):
+    """Return whether a pooled connection is still usable."""
+    if conn.closed:
+        return False
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT 1")
+        conn.rollback()
+        return True
+    except psycopg2.Error:
+        return False
+
+
+def get_connection(database_name, db_params):
+    """Take a healthy connection to a database out of its pool.
+
+    Dead connections are discarded, and failed connection attempts are
+    retried with an exponential backoff. Returns None if the database
+    stays unreachable.
+    """
+    pool = get_pool(database_name, db_params)
+    delay = RETRY_DELAY
+    for attempt in range(CONNECT_RETRIES + 1):
+        try:
+            conn = pool.getconn()
+            if check_connection(conn):
+                return conn
+            pool.putconn(conn, close=True)
+            logging.warning(f"Discarded a dead connection to {database_name}.")
+        except psycopg2.pool.PoolError as e:
+            # PoolError is a psycopg2.Error, it must be caught first
+            logging.error(f"No connection available for {database_name}: {e}")
+            return None
+        except psycopg2.Error as e:
+            logging.warning(f"Connection attempt {attempt + 1} to {database_name} failed: {e}")
+        if attempt < CONNECT_RETRIES:
+            time.sleep(delay)
+            delay *= 2
+    logging.error(f"Error connecting to the database {database_name}.")
+    return None
+
+
+def release_connection(database_name, conn):
+    """Give a connection back to its pool, closing it if it is broken."""
+    broken = bool(conn.closed)
+    if not broken:
+        try:
+            conn.rollback()
+        except psycopg2.Error:
+            broken = True
+    pools[database_name].putconn(conn, close=broken)
+
+
+def close_pools():
+    """Close every pooled connection."""
+    with pools_lock:
+        for pool in pools.values():
+            pool.closeall()
+        pools.clear()
@@ -0,0 +1,139 @@
+import json
+import logging
+import os
+import time
+from datetime import datetime
+from delestage import report
+from delestage.config import MERGE_WINDOWS, METRICS_DIRECTORY
+from delestage.metrics import Metrics, timed_rows
+from delestage.pipeline import day_files, prepare_directories, ticket_id
+from delestage.shards import iter_sharded_rows
+from delestage.validation import merge_windows, skipped_lines_paths
+
+# Stages of a file a dry run skips, their time is estimated from the last run
+ESTIMATED_STAGES = ('connection', 'db_delete', 'db_load', 'servicenow_queue')
+
+
+def last_run_rates(path):
+    """Return the time of the skipped stages per file in the last run, and of the load per row.
+
+    The databases load concurrently, so the slowest one gives the time of a
+    stage. Returns None when there is no run record to estimate from.
+    """
+    try:
+        with open(path) as record_file:
+            record = json.load(record_file)
+    except (OSError, ValueError):
+        return None
+    files = len(record.get('files') or {})
+    if not files:
+        return None
+    stage_seconds = {}
+    for span in record['spans']:
+        if span['stage'] in ESTIMATED_STAGES:
+            stage_seconds[span['stage']] = max(stage_seconds.get(span['stage'], 0.0), span['seconds'])
+    rates = {stage: seconds / files for stage, seconds in stage_seconds.items() if stage != 'db_load'}
+    loaded = record['counters'].get('loaded', 0)
+    rates['db_load_per_row'] = stage_seconds.get('db_load', 0.0) / loaded if loaded else 0.0
+    return rates
+
+
+def estimate_stages(rates, rows_count):
+    """Return the estimated seconds of the skipped stages for a file of rows_count rows to load."""
+    if rates is None:
+        return {}
+    estimates = {stage: rates[stage] for stage in ESTIMATED_STAGES if stage in rates}
+    estimates['db_load'] = rates['db_load_per_row'] * rows_count
+    return estimates
+
+
+def dry_run_file(latest_file, today_date, rates):
+    """Validate, normalize and report a file like process_file, without loading it.
+
+    The report is written to summary_reports/<ticket>_dry-run_summary_report.csv,
+    as if every valid row had loaded. Nothing is loaded, archived or sent to
+    ServiceNow. Returns the outcome of the file, with the seconds measured
+    per stage and those estimated for the skipped stages.
+    """
+    start_time = datetime.now()
+    file_metrics = Metrics()
+    snow_id = ticket_id(latest_file)
+    dynamic_id = f"{snow_id}_dry-run"
+    stats = {}
+    rows = list(timed_rows(iter_sharded_rows(latest_file, stats), 'validation', file_metrics))
+    if MERGE_WINDOWS:
+        with file_metrics.span('merge'):
+            rows = merge_windows(rows, stats)
+    estimates = estimate_stages(rates, len(rows))
+
+    with file_metrics.span('report'):
+        report_writer = report.ReportWriter(dynamic_id)
+        try:
+            report_writer.add_loaded(rows)
+            report_writer.settle_loaded(True)
+            report_writer.add_skipped_lines(skipped_lines_paths(snow_id)[1])
+            report_content = report.build_report(
+                latest_file, report_writer, [], len(rows), 0, stats.get('skipped', 0),
+                estimates.get('db_load', 0), stats.get('merged', 0)
+            )
+        finally:
+            report_writer.close()
+        status = report.file_status(len(rows), 0, stats.get('skipped', 0))
+        summary_report_path = report.summary_report_path(dynamic_id)
+        with open(summary_report_path, "w") as summary_report_file:
+            summary_report_file.write(f"Dry run report for {today_date}, nothing was loaded\n\n")
+            summary_report_file.write(report_content)
+            summary_report_file.write("-" * 50 + "\n")
+        report.write_final_status(summary_report_path, status, start_time, datetime.now())
+
+    measured = {span['stage']: span['seconds'] for span in file_metrics.as_dict()['spans']}
+    return {
+        'file': latest_file, 'status': status, 'rows': len(rows), 'stats': stats,
+        'measured': measured, 'estimated': estimates, 'report': summary_report_path,
+    }
+
+
+def format_seconds(seconds):
+    return ", ".join(f"{stage} {value:.3f} s" for stage, value in seconds.items()) or "none"
+
+
+def run_dry_run():
+    """Run the import of the day's files without any database or ServiceNow access.
+
+    Prints the seconds each stage took, and those the database and
+    ServiceNow stages would have taken, estimated from the last run record
+    in [Metrics] directory. Run metrics are not written, so that the next
+    estimates still come from a real run. Returns the status each file
+    would get.
+    """
+    prepare_directories()
+    today_date = datetime.now().strftime("%Y-%m-%d")
+    discovery_start = time.perf_counter()
+    files = day_files(today_date)
+    discovery_seconds = time.perf_counter() - discovery_start
+    last_run_path = os.path.join(METRICS_DIRECTORY, 'last_run.json')
+    rates = last_run_rates(last_run_path)
+    if rates is None:
+        logging.warning(f"No run record in {last_run_path}, the database and ServiceNow times are not estimated.")
+
+    measured_total = discovery_seconds
+    estimated_total = 0.0
+    statuses = {}
+    print(f"Dry run, discovery: {discovery_seconds:.3f} s, {len(files)} files")
+    for latest_file in files:
+        outcome = dry_run_file(latest_file, today_date, rates)
+        statuses[latest_file] = outcome['status']
+        measured_total += sum(outcome['measured'].values())
+        estimated_total += sum(outcome['estimated'].values())
+        print(
+            f"{latest_file}: {outcome['status']}, {outcome['stats'].get('valid', 0)} valid, "
+            f"{outcome['stats'].get('skipped', 0)} skipped, {outcome['stats'].get('merged', 0)} merged, "
+            f"{outcome['rows']} rows to load, report in {outcome['report']}\n"
+            f"  measured: {format_seconds(outcome['measured'])}\n"
+            f"  estimated: {format_seconds(outcome['estimated'])}"
+        )
+    print(
+        f"Total: {measured_total:.3f} s measured, {estimated_total:.3f} s estimated for the databases and "
+        f"ServiceNow, {measured_total + estimated_total:.3f} s for a real run"
+    )
+    return statuses
@@ -0,0 +1,544 @@
+import logging
+import queue
+import re
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+import psycopg2
+from psycopg2 import sql
+from psycopg2.extras import execute_batch, execute_values
+from delestage.config import BATCH_SIZE, CONSISTENCY, LOAD_METHOD, RELOAD_MODE
+from delestage.schema import TABLE_NAME, create_table
+
+STAGING_TABLE_NAME = f'{TABLE_NAME}_staging'
+OLD_TABLE_NAME = f'{TABLE_NAME}_old'
+
+
+def lock_table(conn):
+    """Wait until no other import is writing the table of this database.
+
+    Uses a session-level advisory lock, so files processed in parallel load
+    one after the other. The wait is not limited by [Connection]
+    statement_timeout, since it lasts as long as the load of another file.
+    The lock is released by unlock_table or when the connection is closed.
+    """
+    with conn.cursor() as cursor:
+        cursor.execute("SET LOCAL statement_timeout = 0")
+        cursor.execute("SELECT pg_advisory_lock(hashtext(%s))", (TABLE_NAME,))
+    conn.commit()
+
+
+def unlock_table(conn):
+    """Release the lock taken by lock_table.
+
+    When the unlock fails, the connection is closed, which ends the session
+    and so releases its lock, instead of going back to the pool with the
+    lock held. release_connection then discards the closed connection.
+    """
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT pg_advisory_unlock(hashtext(%s))", (TABLE_NAME,))
+        conn.commit()
+    except psycopg2.Error as e:
+        logging.error(f"Error releasing the lock on {TABLE_NAME}, closing the connection: {e}")
+        conn.close()
+
+
+def delete_all_rows(conn, commit=True):
+    """Delete all rows from the table."""
+    try:
+        with conn.cursor() as cursor:
+            delete_query = sql.SQL("DELETE FROM cp_insee_delestage")
+            cursor.execute(delete_query)
+        if commit:
+            conn.commit()
+        logging.info("All rows deleted from cp_insee_delestage table.")
+        return True
+    except psycopg2.Error as e:
+        conn.rollback()
+        logging.error(f"Error deleting rows from the table: {e}")
+        return False
+
+
+def create_staging_table(conn):
+    """Create an empty UNLOGGED copy of the table to load the new dataset into."""
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute(
+                sql.SQL("DROP TABLE IF EXISTS {}").format(sql.Identifier(STAGING_TABLE_NAME))
+            )
+            cursor.execute(
+                sql.SQL(
+                    "CREATE UNLOGGED TABLE {} (LIKE {} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)"
+                ).format(sql.Identifier(STAGING_TABLE_NAME), sql.Identifier(TABLE_NAME))
+            )
+        conn.commit()
+        logging.info(f"Staging table {STAGING_TABLE_NAME} created.")
+        return True
+    except psycopg2.Error as e:
+        conn.rollback()
+        logging.error(f"Error creating the staging table: {e}")
+        return False
+
+
+def prepare_staging_table(cursor):
+    """Make the staging table durable and give it the indexes and grants of the live table.
+
+    Indexes are built once the data is loaded, under a temporary name since
+    index names are unique per schema. Returns the (temporary, final) index
+    name pairs to rename once the tables are swapped.
+    """
+    cursor.execute(sql.SQL("ALTER TABLE {} SET LOGGED").format(sql.Identifier(STAGING_TABLE_NAME)))
+
+    cursor.execute(
+        """
+        SELECT index_class.relname, pg_get_indexdef(index_class.oid), con.contype
+        FROM pg_index idx
+        JOIN pg_class index_class ON index_class.oid = idx.indexrelid
+        LEFT JOIN pg_constraint con ON con.conindid = idx.indexrelid AND con.contype IN ('p', 'u')
+        WHERE idx.indrelid = %s::regclass
+        """,
+        (TABLE_NAME,)
+    )
+    renames = []
+    for index_name, index_definition, constraint_type in cursor.fetchall():
+        staging_index_name = f"{index_name[:59]}_stg"
+        index_definition = re.sub(
+            r"^(CREATE (?:UNIQUE )?INDEX )\S+ ON \S+",
+            lambda match: f"{match.group(1)}{staging_index_name} ON {STAGING_TABLE_NAME}",
+            index_definition
+        )
+        cursor.execute(index_definition)
+        if constraint_type:
+            # Constraint-backed indexes must become constraints again
+            cursor.execute(
+                sql.SQL("ALTER TABLE {} ADD CONSTRAINT {} {} USING INDEX {}").format(
+                    sql.Identifier(STAGING_TABLE_NAME),
+                    sql.Identifier(staging_index_name),
+                    sql.SQL("PRIMARY KEY" if constraint_type == 'p' else "UNIQUE"),
+                    sql.Identifier(staging_index_name)
+                )
+            )
+        renames.append((staging_index_name, index_name))
+
+    cursor.execute(
+        """
+        SELECT grantee, privilege_type
+        FROM information_schema.role_table_grants
+        WHERE table_schema = current_schema() AND table_name = %s AND grantee <> current_user
+        """,
+        (TABLE_NAME,)
+    )
+    for grantee, privilege in cursor.fetchall():
+        cursor.execute(
+            sql.SQL("GRANT {} ON {} TO {}").format(
+                sql.SQL(privilege),
+                sql.Identifier(STAGING_TABLE_NAME),
+                sql.SQL("PUBLIC") if grantee == 'PUBLIC' else sql.Identifier(grantee)
+            )
+        )
+    return renames
+
+
+def swap_staging_table(conn, renames):
+    """Replace the live table with the loaded staging table.
+
+    renames comes from prepare_staging_table. The rename happens in one short
+    transaction, so readers see either the previous or the new dataset, and
+    the previous table is dropped instead of leaving dead tuples behind.
+    """
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute(
+                sql.SQL("LOCK TABLE {} IN ACCESS EXCLUSIVE MODE").format(sql.Identifier(TABLE_NAME))
+            )
+            # Serial sequences are owned by the live table and would be dropped with it
+            cursor.execute(
+                """
+                SELECT attname, pg_get_serial_sequence(%s, attname)
+                FROM pg_attribute
+                WHERE attrelid = %s::regclass AND attnum > 0 AND NOT attisdropped
+                """,
+                (TABLE_NAME, TABLE_NAME)
+            )
+            for column, sequence in cursor.fetchall():
+                if sequence:
+                    cursor.execute(
+                        sql.SQL("ALTER SEQUENCE {} OWNED BY {}.{}").format(
+                            sql.SQL(sequence), sql.Identifier(STAGING_TABLE_NAME), sql.Identifier(column)
+                        )
+                    )
+            cursor.execute(
+                sql.SQL("ALTER TABLE {} RENAME TO {}").format(
+                    sql.Identifier(TABLE_NAME), sql.Identifier(OLD_TABLE_NAME)
+                )
+            )
+            cursor.execute(
+                sql.SQL("ALTER TABLE {} RENAME TO {}").format(
+                    sql.Identifier(STAGING_TABLE_NAME), sql.Identifier(TABLE_NAME)
+                )
+            )
+            cursor.execute(sql.SQL("DROP TABLE {}").format(sql.Identifier(OLD_TABLE_NAME)))
+            for staging_index_name, index_name in renames:
+                cursor.execute(
+                    sql.SQL("ALTER INDEX {} RENAME TO {}").format(
+                        sql.Identifier(staging_index_name), sql.Identifier(index_name)
+                    )
+                )
+        conn.commit()
+        logging.info(f"Staging table swapped into {TABLE_NAME}.")
+        return True
+    except psycopg2.Error as e:
+        conn.rollback()
+        logging.error(f"Error swapping the staging table into {TABLE_NAME}: {e}")
+        return False
+
+
+def prepare_insert(conn, cursor, table):
+    """Prepare the single row INSERT into table once per session, returns its name."""
+    statement = f"delestage_insert_{table}"
+    if statement not in conn.prepared_statements:
+        cursor.execute(
+            sql.SQL("""
+                PREPARE {} (text, text, timestamp, timestamp) AS
+                INSERT INTO {} (cp, ci, heure_debut, heure_fin, date_heure_maj) VALUES ($1, $2, $3, $4, now())""").format(
+                sql.Identifier(statement), sql.Identifier(table)
+            )
+        )
+        conn.prepared_statements.add(statement)
+    return statement
+
+
+def insert_data(conn, data, insertion_errors, table=TABLE_NAME):
+    """Insert data into the database if the couple CI/CP does not exist."""
+    cp, ci, heure_debut, heure_fin = data
+    try:
+        with conn.cursor() as cursor:
+            statement = prepare_insert(conn, cursor, table)
+            cursor.execute(
+                sql.SQL("EXECUTE {} (%s, %s, %s, %s)").format(sql.Identifier(statement)),
+                (cp, ci, heure_debut, heure_fin)
+            )
+        conn.commit()
+        logging.info(f"Inserted data: {data}")
+        return True
+    except psycopg2.Error as e:
+        logging.error(f"Error inserting data into the database: {e}")
+        insertion_errors.append({'cp': cp, 'ci': ci, 'error_message': str(e)})
+        return False
+
+
+def insert_batch(conn, batch, insertion_errors, table=TABLE_NAME):
+    """Insert a batch of rows inside the current transaction.
+
+    The batch runs under a savepoint. When it fails, it is split in halves
+    until the faulty rows are isolated, so only those rows are reported in
+    insertion_errors. Returns the list of rows actually inserted.
+    """
+    insert_query = sql.SQL(
+        "INSERT INTO {} (cp, ci, heure_debut, heure_fin, date_heure_maj) VALUES %s"
+    ).format(sql.Identifier(table))
+    with conn.cursor() as cursor:
+        cursor.execute("SAVEPOINT delestage_batch")
+        try:
+            execute_values(
+                cursor, insert_query, batch,
+                template="(%s, %s, %s, %s, now())",
+                page_size=len(batch)
+            )
+        except psycopg2.Error as e:
+            cursor.execute("ROLLBACK TO SAVEPOINT delestage_batch")
+            cursor.execute("RELEASE SAVEPOINT delestage_batch")
+            if len(batch) == 1:
+                cp, ci = batch[0][:2]
+                logging.error(f"Error inserting data into the database: {e}")
+                insertion_errors.append({'cp': cp, 'ci': ci, 'error_message': str(e)})
+                return []
+            middle = len(batch) // 2
+            return (
+                insert_batch(conn, batch[:middle], insertion_errors, table) +
+                insert_batch(conn, batch[middle:], insertion_errors, table)
+            )
+        cursor.execute("RELEASE SAVEPOINT delestage_batch")
+    return list(batch)
+
+
+def row_key(row):
+    """Normalize a (cp, ci, heure_debut, heure_fin) row so file and table rows compare equal."""
+    cp, ci, heure_debut, heure_fin = row
+    if isinstance(heure_debut, datetime):
+        heure_debut = heure_debut.strftime('%Y-%m-%d %H:%M:%S')
+    if isinstance(heure_fin, datetime):
+        heure_fin = heure_fin.strftime('%Y-%m-%d %H:%M:%S')
+    return (str(cp).strip(), str(ci).strip(), heure_debut, heure_fin)
+
+
+def fetch_current_rows(conn, table=TABLE_NAME):
+    """Return the rows currently in the table as a Counter of row keys."""
+    # A named cursor streams the table instead of fetching it in one go
+    with conn.cursor(name='delestage_current_rows') as cursor:
+        cursor.itersize = BATCH_SIZE
+        cursor.execute(
+            sql.SQL("SELECT cp, ci, heure_debut, heure_fin FROM {}").format(sql.Identifier(table))
+        )
+        return Counter(row_key(row) for row in cursor)
+
+
+def apply_diff(conn, incoming, insertion_errors, table=TABLE_NAME):
+    """Bring the table in line with the incoming rows by only writing the differences.
+
+    incoming is the Counter of the row keys to load, since the same CP/CI
+    window can appear several times. It is only read, so every database
+    can share it. Nothing is committed. Returns the Counter of row keys
+    now present in the table, with the number of inserted, deleted and
+    unchanged rows, or None if the diff could not be applied.
+    """
+    try:
+        current = fetch_current_rows(conn, table)
+        to_delete = current - incoming
+        with conn.cursor() as cursor:
+            execute_batch(
+                cursor,
+                sql.SQL(
+                    "DELETE FROM {0} WHERE ctid IN (SELECT ctid FROM {0} "
+                    "WHERE cp = %s AND ci = %s AND heure_debut = %s AND heure_fin = %s LIMIT %s)"
+                ).format(sql.Identifier(table)),
+                [key + (count,) for key, count in to_delete.items()],
+                page_size=BATCH_SIZE
+            )
+    except psycopg2.Error as e:
+        conn.rollback()
+        logging.error(f"Error computing the differences with {table}: {e}")
+        insertion_errors.append({'cp': '*', 'ci': '*', 'error_message': str(e)})
+        return None
+
+    unchanged = incoming & current
+    to_insert = list((incoming - current).elements())
+    inserted = []
+    for start in range(0, len(to_insert), BATCH_SIZE):
+        end = start + BATCH_SIZE
+        batch = to_insert[start:end]
+        inserted += insert_batch(conn, batch, insertion_errors, table)
+    deleted_count = sum(to_delete.values())
+    logging.info(
+        f"Diff applied to {table}: {len(inserted)} inserted, {deleted_count} deleted, "
+        f"{sum(unchanged.values())} unchanged."
+    )
+    return unchanged + Counter(inserted), len(inserted), deleted_count, sum(unchanged.values())
+
+
+def load_target(database_name, conn, batch_queue, errors=None, on_loaded=None, checkpoint=None, incoming=None):
+    """Load the batches received on batch_queue into one database.
+
+    Runs in its own thread, one per database. Batches are written in a
+    transaction that is left open for finish_target, except in row mode
+    where each row is committed. Insertion errors are appended to errors
+    and the rows loaded are passed to on_loaded, so that they are not kept
+    in memory. With a checkpoint, each batch is committed and recorded so
+    that a rerun after a crash skips the batches already committed, see
+    Checkpoint. In diff mode, no batches are sent, the table is compared
+    with incoming, see apply_diff. Returns the number of rows loaded, the insertion errors, the
+    load duration, the part of it spent emptying the table, the batches and
+    errors of a previous run it resumed from, the batches committed so far
+    and whether the database failed as a whole.
+    """
+    start = time.perf_counter()
+    result = {
+        'database': database_name, 'loaded': 0, 'errors': [] if errors is None else errors,
+        'failed': False, 'renames': [], 'inserted': 0, 'deleted': 0, 'unchanged': 0,
+        'delete_seconds': 0.0, 'resumed_batches': 0, 'resumed_errors': 0, 'committed_batches': 0
+    }
+    on_loaded = on_loaded or (lambda rows: None)
+    table = STAGING_TABLE_NAME if RELOAD_MODE == 'swap' else TABLE_NAME
+    if conn is None:
+        # An unreachable database is a failed load, so consistency applies to it too
+        logging.error(f"{database_name}: unable to connect to the database.")
+        result['errors'].append({'cp': '*', 'ci': '*', 'error_message': 'Unable to connect to the database'})
+        result['failed'] = True
+    else:
+        result['failed'] = not create_table(conn)
+    resumed = None
+    if not result['failed'] and checkpoint is not None:
+        resumed = checkpoint.resume(database_name, conn, table)
+    if resumed is not None:
+        result['resumed_batches'] = result['committed_batches'] = resumed['batches']
+        result['resumed_errors'] = resumed['errors']
+        result['loaded'] = resumed['loaded']
+    elif result['failed']:
+        if conn is not None:
+            logging.error(f"{database_name}: unable to create the table {TABLE_NAME}.")
+    elif RELOAD_MODE == 'swap':
+        result['failed'] = not create_staging_table(conn)
+    else:
+        if RELOAD_MODE == 'delete':
+            result['failed'] = not delete_all_rows(conn, commit=LOAD_METHOD == 'row')
+            result['delete_seconds'] = time.perf_counter() - start
+
+    batch_number = 0
+    # The queue is drained even after a failure so the reader never blocks
+    for batch in iter(batch_queue.get, None):
+        batch_number += 1
+        if result['failed'] or batch_number <= result['resumed_batches']:
+            continue
+        try:
+            if LOAD_METHOD == 'bulk':
+                errors_before = len(result['errors'])
+                inserted = insert_batch(conn, batch, result['errors'], table)
+                if checkpoint is not None:
+                    checkpoint.prepare(
+                        database_name, conn, batch_number, len(inserted), len(result['errors']) - errors_before
+                    )
+                    conn.commit()
+                    checkpoint.commit(database_name)
+                    result['committed_batches'] = batch_number
+                result['loaded'] += len(inserted)
+                on_loaded(inserted)
+                logging.info(f"{database_name}: inserted {len(inserted)}/{len(batch)} rows of the batch.")
+            else:
+                inserted = [data for data in batch if insert_data(conn, data, result['errors'], table)]
+                result['loaded'] += len(inserted)
+                on_loaded(inserted)
+        except Exception as e:
+            # Row errors are isolated by insert_batch, this is the database itself, or
+            # on_loaded, failing. The queue is still drained so the reader never blocks.
+            logging.error(f"{database_name}: error loading the data: {e}")
+            result['failed'] = True
+
+    try:
+        if not result['failed'] and RELOAD_MODE == 'diff':
+            diff_result = apply_diff(conn, incoming, result['errors'])
+            if diff_result is None:
+                result['failed'] = True
+            else:
+                loaded, result['inserted'], result['deleted'], result['unchanged'] = diff_result
+                result['loaded'] = sum(loaded.values())
+                on_loaded(loaded.elements())
+        elif not result['failed'] and RELOAD_MODE == 'swap':
+            # Indexes are built before the swap so the swap itself stays short
+            conn.commit()
+            with conn.cursor() as cursor:
+                result['renames'] = prepare_staging_table(cursor)
+    except Exception as e:
+        logging.error(f"{database_name}: error preparing the data: {e}")
+        result['failed'] = True
+    if result['failed'] and conn is not None:
+        try:
+            conn.rollback()
+        except psycopg2.Error as e:
+            logging.error(f"{database_name}: error rolling back the load: {e}")
+    result['seconds'] = time.perf_counter() - start
+    return result
+
+
+def finish_target(conn, result, commit):
+    """Commit (or swap in) the data loaded by load_target, or roll it back.
+
+    Rows loaded by the row method in delete mode are committed one by one,
+    and so are the batches of a checkpointed load in delete mode, they can
+    no longer be rolled back and are reported as committed.
+    """
+    start = time.perf_counter()
+    result['committed'] = False
+    try:
+        if conn is None:
+            pass
+        elif RELOAD_MODE == 'delete' and (LOAD_METHOD == 'row' or result['committed_batches']):
+            if not commit:
+                logging.warning(
+                    f"{result['database']}: the load is not consistent, but the rows already loaded "
+                    "are committed."
+                )
+            conn.commit()
+            result['committed'] = True
+        elif not commit:
+            conn.rollback()
+        elif RELOAD_MODE == 'swap':
+            result['committed'] = swap_staging_table(conn, result['renames'])
+        else:
+            conn.commit()
+            result['committed'] = True
+    except psycopg2.Error as e:
+        logging.error(f"{result['database']}: error committing the data: {e}")
+    result['seconds'] += time.perf_counter() - start
+    logging.info(
+        f"{result['database']}: {'committed' if result['committed'] else 'rolled back'}, "
+        f"{result['loaded']} rows in {result['seconds']:.2f} seconds."
+    )
+    return result
+
+
+def load_rows(targets, rows, errors=None, on_loaded=None, checkpoint=None):
+    """Load rows into every database concurrently and commit them.
+
+    targets is the list of (database name, connection), Database1 first,
+    the connection being None for a database that could not be reached.
+    Each database is locked, then loaded by its own thread from the same
+    batches, and finally committed or rolled back according to [General]
+    consistency. errors optionally gives the insertion errors collector of
+    each database, and on_loaded receives the rows loaded into Database1.
+    checkpoint optionally records the progress of the load, see load_target.
+    Returns one result per database, see load_target and finish_target.
+    """
+    locked = []
+    try:
+        # Databases are always locked in the same order to avoid deadlocks
+        for name, conn in targets:
+            if conn is not None:
+                lock_table(conn)
+                locked.append(conn)
+        return load_locked_rows(targets, rows, errors, on_loaded, checkpoint)
+    except BaseException:
+        # unlock_table commits, the partial load must be rolled back first
+        for conn in locked:
+            try:
+                conn.rollback()
+            except psycopg2.Error as e:
+                logging.error(f"Error rolling back the load: {e}")
+        raise
+    finally:
+        for conn in locked:
+            unlock_table(conn)
+
+
+def load_locked_rows(targets, rows, errors=None, on_loaded=None, checkpoint=None):
+    """Load rows into every database once they are locked, see load_rows."""
+    batch_queues = [queue.Queue(maxsize=4) for _ in targets]
+    errors = errors or [None] * len(targets)
+    incoming = None
+    if RELOAD_MODE == 'diff':
+        # One multiset of the rows shared by every database, instead of a copy per database
+        incoming = Counter(row_key(row) for row in rows)
+        rows = ()
+    with ThreadPoolExecutor(max_workers=len(targets)) as executor:
+        futures = [
+            executor.submit(
+                load_target, name, conn, batch_queue, target_errors, on_loaded if index == 0 else None, checkpoint,
+                incoming
+            )
+            for index, ((name, conn), batch_queue, target_errors) in enumerate(zip(targets, batch_queues, errors))
+        ]
+        try:
+            batch = []
+            for row in rows:
+                batch.append(row)
+                if len(batch) >= BATCH_SIZE:
+                    for batch_queue in batch_queues:
+                        batch_queue.put(batch)
+                    batch = []
+            if batch:
+                for batch_queue in batch_queues:
+                    batch_queue.put(batch)
+        finally:
+            for batch_queue in batch_queues:
+                batch_queue.put(None)
+        results = [future.result() for future in futures]
+
+        commit_all = not any(result['failed'] for result in results)
+        commits = [
+            commit_all or (CONSISTENCY == 'independent' and not result['failed'])
+            for result in results
+        ]
+        return list(executor.map(
+            finish_target, [conn for name, conn in targets], results, commits
+        ))
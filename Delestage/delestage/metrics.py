@@ -0,0 +1,164 @@
+import json
+import logging
+import os
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from datetime import datetime
+from delestage.config import METRICS_DIRECTORY, METRICS_TEXTFILE
+
+
+class Metrics:
+    """Time spent in each stage of a run and row counters.
+
+    Stages are timed with span() or add_time(), optionally per target
+    database. Safe to use from the loading threads.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.spans = {}
+        self.counters = Counter()
+
+    @contextmanager
+    def span(self, stage, target=''):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(stage, time.perf_counter() - start, target)
+
+    def add_time(self, stage, seconds, target=''):
+        with self.lock:
+            calls, total = self.spans.get((stage, target), (0, 0.0))
+            self.spans[(stage, target)] = (calls + 1, total + seconds)
+
+    def count(self, name, value=1):
+        with self.lock:
+            self.counters[name] += value
+
+    def as_dict(self):
+        """Return the metrics as plain data, to send them across processes or to JSON."""
+        with self.lock:
+            return {
+                'spans': [
+                    {'stage': stage, 'target': target, 'calls': calls, 'seconds': round(seconds, 6)}
+                    for (stage, target), (calls, seconds) in sorted(self.spans.items())
+                ],
+                'counters': dict(self.counters),
+            }
+
+    def merge(self, record):
+        """Add the metrics of as_dict(), e.g. those of a file processed in a worker process."""
+        with self.lock:
+            for span in record['spans']:
+                key = (span['stage'], span['target'])
+                calls, total = self.spans.get(key, (0, 0.0))
+                self.spans[key] = (calls + span['calls'], total + span['seconds'])
+            self.counters.update(record['counters'])
+
+
+# Metrics of the run of this process
+run_metrics = Metrics()
+
+
+def timed_rows(rows, stage, metrics):
+    """Iterate over rows, adding the time spent producing them to stage.
+
+    The validation is a generator consumed by the load, this separates the
+    time it takes from the time spent in the databases.
+    """
+    rows = iter(rows)
+    seconds = 0.0
+    try:
+        while True:
+            start = time.perf_counter()
+            try:
+                row = next(rows)
+            except StopIteration:
+                return
+            finally:
+                seconds += time.perf_counter() - start
+            yield row
+    finally:
+        metrics.add_time(stage, seconds)
+
+
+def prometheus_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def prometheus_textfile(record):
+    """Format a run record for the node exporter textfile collector."""
+    lines = [
+        "# HELP delestage_stage_duration_seconds Time spent in each stage of the last run.",
+        "# TYPE delestage_stage_duration_seconds gauge",
+    ]
+    for span in record['spans']:
+        lines.append(
+            f'delestage_stage_duration_seconds{{stage="{prometheus_label(span["stage"])}",'
+            f'target="{prometheus_label(span["target"])}"}} {span["seconds"]}'
+        )
+    lines += [
+        "# HELP delestage_rows Rows of the last run by outcome.",
+        "# TYPE delestage_rows gauge",
+    ]
+    for name, value in sorted(record['counters'].items()):
+        lines.append(f'delestage_rows{{status="{prometheus_label(name)}"}} {value}')
+    lines += [
+        "# HELP delestage_files Files of the last run by final status.",
+        "# TYPE delestage_files gauge",
+    ]
+    for status, count in sorted(Counter(record['files'].values()).items()):
+        lines.append(f'delestage_files{{status="{prometheus_label(status)}"}} {count}')
+    lines += [
+        "# HELP delestage_run_duration_seconds Duration of the last run.",
+        "# TYPE delestage_run_duration_seconds gauge",
+        f"delestage_run_duration_seconds {record['duration_seconds']}",
+        "# HELP delestage_last_run_timestamp_seconds End of the last run, as a Unix timestamp.",
+        "# TYPE delestage_last_run_timestamp_seconds gauge",
+        f"delestage_last_run_timestamp_seconds {record['finished_timestamp']}",
+    ]
+    return "\n".join(lines) + "\n"
+
+
+def write_atomically(path, content):
+    """Replace a file at once, so that a reader never sees it half written."""
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    temporary_path = f"{path}.{os.getpid()}.tmp"
+    with open(temporary_path, 'w') as temporary_file:
+        temporary_file.write(content)
+    os.replace(temporary_path, path)
+
+
+def write_run_metrics(start_time, files, metrics=run_metrics):
+    """Write the JSON run record and the Prometheus textfile of a run.
+
+    files maps each file processed to its final status. The record is
+    written to [Metrics] directory as run_<date>_<time>.json and
+    last_run.json, the textfile to [Metrics] textfile.
+    """
+    end_time = datetime.now()
+    record = {
+        'started': start_time.isoformat(timespec='seconds'),
+        'finished': end_time.isoformat(timespec='seconds'),
+        'finished_timestamp': round(end_time.timestamp(), 3),
+        'duration_seconds': round((end_time - start_time).total_seconds(), 3),
+        'files': files,
+        **metrics.as_dict(),
+    }
+    try:
+        content = json.dumps(record, indent=2)
+        run_record_path = os.path.join(METRICS_DIRECTORY, f"run_{start_time.strftime('%Y%m%d_%H%M%S')}.json")
+        write_atomically(run_record_path, content)
+        write_atomically(os.path.join(METRICS_DIRECTORY, 'last_run.json'), content)
+        if METRICS_TEXTFILE:
+            write_atomically(METRICS_TEXTFILE, prometheus_textfile(record))
+    except OSError as e:
+        logging.error(f"Error writing the run metrics: {e}")
+        return None
+    logging.info(f"Run metrics written to {run_record_path}")
+    return record
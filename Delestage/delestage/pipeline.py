@@ -0,0 +1,271 @@
+import glob
+import itertools
+import logging
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from delestage import archive, report
+from delestage.checkpoint import Checkpoint
+from delestage.config import CHECKPOINT, DATA_DIRECTORY, LOAD_METHOD, MERGE_WINDOWS, RELOAD_MODE, WORKERS, databases
+from delestage.db import close_pools, get_connection, release_connection
+from delestage.loader import load_rows
+from delestage.metrics import Metrics, run_metrics, timed_rows
+from delestage.servicenow import close_ticket_on_servicenow, start_outbox_worker
+from delestage.shards import iter_sharded_rows
+from delestage.validation import merge_windows, skipped_lines_paths
+
+
+class LoadTurns:
+    """Order in which the files of a run load, shared by the worker processes.
+
+    Each file waits until every file before it has loaded or failed, so
+    that files validated in parallel still load in the order they are
+    given. The files of a day are given by arrival, see day_files, so the
+    file that arrived last is the last one in the table.
+    """
+
+    def __init__(self, context, count):
+        self.condition = context.Condition()
+        self.finished = context.Array('b', count, lock=False)
+
+    def wait(self, turn):
+        with self.condition:
+            self.condition.wait_for(lambda: all(self.finished[:turn]))
+
+    def done(self, turn):
+        with self.condition:
+            self.finished[turn] = True
+            self.condition.notify_all()
+
+
+# Load turns of the worker processes, see process_files
+load_turns = None
+
+
+def set_load_turns(turns):
+    global load_turns
+    load_turns = turns
+
+
+def ticket_id(file_path):
+    """Return the ServiceNow ticket id a file is named after."""
+    return os.path.splitext(os.path.basename(file_path))[0].split('_')[0]
+
+
+def process_file(latest_file, today_date, prevalidate=False, turn=None):
+    """Load one ticket file, write its summary report, archive it and close its ticket.
+
+    With prevalidate, the whole file is validated before waiting for the
+    table lock, so that it overlaps with the load of another file. turn is
+    the position of the file in the load order of a parallel run, see
+    LoadTurns. Returns the final status of the file and the metrics of its
+    stages, see Metrics.as_dict.
+    """
+    start_time = datetime.now()
+    file_metrics = Metrics()
+    log_directory = 'logs'
+    dynamic_id = ticket_id(latest_file)
+    summary_report_path = report.summary_report_path(dynamic_id)
+    status = "KO"
+    file_sha256 = None
+    targets = []
+    try:
+        log_filename = f"{dynamic_id}_script.log"
+        log_file_path = os.path.join(log_directory, log_filename)
+        logging.basicConfig(
+            filename=log_file_path,
+            level=logging.INFO,
+            format='%(asctime)s - %(levelname)s - %(message)s'
+        )
+
+        with open(summary_report_path, "w") as summary_report_file:
+            summary_report_file.write(f"Summary Report for {today_date}\n\n")
+
+            logging.info(f"Processing file: {latest_file}")
+            file_sha256 = archive.file_hash(latest_file)
+
+            validation_stats = {}
+            with file_metrics.span('connection'):
+                targets = [(name, get_connection(name, params)) for name, params in databases]
+            # The other unreachable databases are loaded as failed targets, see load_rows
+            if targets[0][1] is None:
+                return status, file_metrics.as_dict()
+
+            # Lines are validated and normalized as they are read
+            rows = timed_rows(iter_sharded_rows(latest_file, validation_stats), 'validation', file_metrics)
+            if MERGE_WINDOWS:
+                # Windows are merged once the whole file is validated
+                rows = list(rows)
+                with file_metrics.span('merge'):
+                    rows = merge_windows(rows, validation_stats)
+            elif prevalidate:
+                rows = list(rows)
+
+            checkpoint = None
+            if CHECKPOINT and LOAD_METHOD == 'bulk' and RELOAD_MODE in ('delete', 'swap'):
+                checkpoint = Checkpoint(latest_file, dynamic_id)
+
+            rows = iter(rows)
+            first_row = next(rows, None)
+            report_writer = report.ReportWriter(dynamic_id)
+            try:
+                results = []
+                load_duration = 0
+                if first_row is None:
+                    # Loading nothing would empty the table, or swap an empty one in
+                    logging.error(f"No valid rows in {latest_file}, the table is left unchanged.")
+                    summary_report_file.write("No valid rows to load, the table was left unchanged.\n")
+                else:
+                    if turn is not None:
+                        load_turns.wait(turn)
+                    load_start = time.perf_counter()
+                    results = load_rows(
+                        targets, itertools.chain([first_row], rows),
+                        [report_writer.error_sink(name) for name, conn in targets],
+                        report_writer.add_loaded, checkpoint
+                    )
+                    load_duration = time.perf_counter() - load_start
+                    if turn is not None:
+                        load_turns.done(turn)
+                    report_writer.settle_loaded(results[0]['committed'])
+                for result in results:
+                    file_metrics.add_time('db_delete', result['delete_seconds'], result['database'])
+                    file_metrics.add_time('db_load', result['seconds'], result['database'])
+
+                with file_metrics.span('report'):
+                    successful_insertions_count, insertion_errors_count = report.collect_results(results)
+                    skipped_lines_count = validation_stats.get('skipped', 0)
+                    report_writer.add_skipped_lines(skipped_lines_paths(dynamic_id)[1])
+                    summary_report_file.write(report.build_report(
+                        latest_file, report_writer, results, successful_insertions_count, insertion_errors_count,
+                        skipped_lines_count, load_duration, validation_stats.get('merged', 0)
+                    ))
+            finally:
+                report_writer.close()
+            summary_report_file.write("-" * 50 + "\n")
+            file_metrics.count('valid', validation_stats.get('valid', 0))
+            file_metrics.count('skipped', skipped_lines_count)
+            file_metrics.count('merged', validation_stats.get('merged', 0))
+            file_metrics.count('failed', insertion_errors_count)
+            file_metrics.count('loaded', successful_insertions_count)
+
+            status = report.file_status(
+                successful_insertions_count, insertion_errors_count, skipped_lines_count
+            )
+            if checkpoint is not None and any(result['failed'] or not result['committed'] for result in results):
+                # The rerun of the file resumes from the batches already committed
+                logging.warning(f"Load of {latest_file} incomplete, the file and its checkpoint are kept.")
+            else:
+                with file_metrics.span('archive'):
+                    archive.archive_file(latest_file, dynamic_id, status, dict(
+                        validation_stats, loaded=successful_insertions_count, failed=insertion_errors_count
+                    ), file_sha256)
+                if checkpoint is not None:
+                    checkpoint.remove()
+
+        logging.info(f"Summary report generated and saved to {summary_report_path}")
+
+        if not insertion_errors_count and skipped_lines_count:
+            logging.info(
+                f"Ticket {dynamic_id} status updated to "
+                "'Waiting for Customer Feedback' due to skipped lines."
+            )
+        elif not insertion_errors_count:
+            logging.info(f"Ticket {dynamic_id} closed successfully.")
+
+    except Exception as e:
+        logging.error(f"Error generating summary report: {str(e)}")
+
+    finally:
+        if turn is not None:
+            # A file that failed before its load must not hold back the next ones
+            load_turns.done(turn)
+        report.write_final_status(summary_report_path, status, start_time, datetime.now())
+
+        logging.info(f"Summary report generated and saved to {summary_report_path}")
+        with file_metrics.span('servicenow_queue'):
+            close_ticket_on_servicenow(dynamic_id, summary_report_path, file_sha256, status)
+        for name, conn in targets:
+            if conn is not None:
+                release_connection(name, conn)
+    return status, file_metrics.as_dict()
+
+
+def prepare_directories():
+    """Create the log and summary report directories."""
+    log_directory = 'logs'
+
+    if not os.path.exists(log_directory):
+        os.makedirs(log_directory)
+    if not os.path.exists(report.summary_report_directory):
+        os.makedirs(report.summary_report_directory)
+
+
+def process_files(files, today_date):
+    """Process files, in parallel worker processes when configured, and return their statuses."""
+    # Ticket closures are sent in the background while the next files load
+    outbox_worker = start_outbox_worker()
+    workers = min(WORKERS, len(files))
+    if workers > 1:
+        # Files are validated in parallel, then loaded one after the other in the order given.
+        # Workers are spawned, not forked, so they never share the pooled connections.
+        context = multiprocessing.get_context('spawn')
+        with ProcessPoolExecutor(
+            max_workers=workers, mp_context=context,
+            initializer=set_load_turns, initargs=(LoadTurns(context, len(files)),)
+        ) as executor:
+            outcomes = list(executor.map(
+                process_file, files, [today_date] * len(files), [True] * len(files), range(len(files))
+            ))
+    else:
+        outcomes = [process_file(latest_file, today_date) for latest_file in files]
+    close_pools()
+    with run_metrics.span('servicenow_flush'):
+        outbox_worker.stop()
+    statuses = []
+    for status, file_metrics in outcomes:
+        statuses.append(status)
+        run_metrics.merge(file_metrics)
+    for latest_file, status in zip(files, statuses):
+        logging.info(f"{latest_file}: {status}")
+    return dict(zip(files, statuses))
+
+
+def day_files(today_date):
+    """Return the files of a day found in the data directory, by arrival.
+
+    Names only differ by their ticket id, so files are ordered by
+    modification time, then by name.
+    """
+    filename_pattern = os.path.join(DATA_DIRECTORY, f'*{today_date}.csv')
+    files = sorted(glob.glob(filename_pattern), key=lambda file_path: (os.path.getmtime(file_path), file_path))
+    if not files:
+        logging.info(filename_pattern)
+        logging.error("No files matching the pattern 'EnedisDelestage.csv' found.")
+    return files
+
+
+def run_import():
+    """Process every file of the day found in the data directory."""
+    prepare_directories()
+
+    today_date = datetime.now().strftime("%Y-%m-%d")
+    with run_metrics.span('discovery'):
+        files = day_files(today_date)
+    if not files:
+        return {}
+
+    return process_files(files, today_date)
+
+
+def run_rerun(ticket_id):
+    """Import the last archived file of a ticket again."""
+    prepare_directories()
+    os.makedirs(DATA_DIRECTORY, exist_ok=True)
+    latest_file = archive.restore_file(ticket_id, DATA_DIRECTORY)
+    if latest_file is None:
+        logging.error(f"No archived file for ticket {ticket_id}.")
+        return {}
+    return process_files([latest_file], datetime.now().strftime("%Y-%m-%d"))
@@ -0,0 +1,71 @@
+import logging
+import os
+import re
+import time
+from delestage.config import DATA_DIRECTORY, databases
+from delestage.db import get_connection, release_connection
+from delestage.metrics import run_metrics
+from delestage.validation import check_header
+
+filename_pattern = r"^[a-fA-F0-9]{32}_\d{4}-\d{2}-\d{2}\.csv$"
+
+
+# Function to check files in the specified format
+def check_files(directory, pattern):
+    matching_files = []
+    for filename in os.listdir(directory):
+        if re.match(pattern, filename):
+            matching_files.append(filename)
+    return matching_files
+
+
+# Function to check database connections, the connection stays in the pool for the import
+def check_db_connections(database_name, db_params):
+    db_connection = get_connection(database_name, db_params)
+    if db_connection is None:
+        logging.error(
+            f"Error: Unable to connect to the database {db_params['database']}."
+        )
+        return False
+    logging.info(
+        f"Database connection successful for {db_params['database']}!"
+    )
+    release_connection(database_name, db_connection)
+    return True
+
+
+def check_databases():
+    """Check the database connections only, for a batch that may restore its files from the archive.
+
+    Returns whether Database1 is reachable, nothing is loaded without it.
+    """
+    reachable = [check_db_connections(name, db_params) for name, db_params in databases]
+    return reachable[0]
+
+
+def run_precheck():
+    """Check the ticket files of the data directory and the database connections.
+
+    Returns the matching files.
+    """
+    start_time = time.time()
+    with run_metrics.span('discovery'):
+        matching_files = check_files(DATA_DIRECTORY, filename_pattern)
+    elapsed_time = time.time() - start_time
+
+    if matching_files:
+        logging.info("Matching files found:")
+        for file in matching_files:
+            file_path = os.path.join(DATA_DIRECTORY, file)
+            logging.info(file_path)
+
+            # Lines are validated while they are imported, only the header is checked here
+            check_header(file_path)
+
+        # Check database connections
+        for name, db_params in databases:
+            check_db_connections(name, db_params)
+    else:
+        logging.info("No matching files found in the specified directory.")
+    logging.info(f"Elapsed time: {elapsed_time:.2f} seconds")
+    return matching_files
@@ -0,0 +1,118 @@
+import bisect
+import logging
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta
+from psycopg2 import sql
+from delestage.config import QUERY_CACHE_TTL, databases
+from delestage.db import get_connection, release_connection
+from delestage.schema import TABLE_NAME
+
+
+class Windows:
+    """Load shedding windows of one CP or CI, [start, end) intervals.
+
+    Starts are sorted, and max_ends[i] is the latest end of the first i + 1
+    windows: a time t is covered when a window starting at or before t
+    ends after t, i.e. when the max_ends entry of the last start <= t is
+    after t. Lookups are a bisection.
+    """
+
+    def __init__(self, windows):
+        windows = sorted(windows)
+        self.windows = windows
+        self.starts = [start for start, end in windows]
+        self.max_ends = []
+        max_end = None
+        for start, end in windows:
+            max_end = end if max_end is None or end > max_end else max_end
+            self.max_ends.append(max_end)
+
+    def covers(self, at):
+        index = bisect.bisect_right(self.starts, at)
+        return index > 0 and self.max_ends[index - 1] > at
+
+    def covering(self, at):
+        """Return the windows covering a time."""
+        index = bisect.bisect_right(self.starts, at)
+        return [(start, end) for start, end in self.windows[:index] if end > at]
+
+
+class DayWindows:
+    """Windows of a day, indexed by CP and by CI."""
+
+    def __init__(self, day, rows):
+        self.day = day
+        self.loaded_at = time.monotonic()
+        by_cp = defaultdict(list)
+        by_ci = defaultdict(list)
+        for cp, ci, heure_debut, heure_fin in rows:
+            by_cp[cp].append((heure_debut, heure_fin))
+            by_ci[ci].append((heure_debut, heure_fin))
+        self.by_cp = {cp: Windows(windows) for cp, windows in by_cp.items()}
+        self.by_ci = {ci: Windows(windows) for ci, windows in by_ci.items()}
+
+
+# Windows of the days queried, refreshed after [Query] cache_ttl seconds
+day_windows = {}
+day_windows_lock = threading.Lock()
+
+
+def fetch_day_windows(conn, day):
+    """Read the windows overlapping a day, with the window index of the table."""
+    day_start = datetime.combine(day, datetime.min.time())
+    with conn.cursor() as cursor:
+        cursor.execute(
+            sql.SQL(
+                "SELECT cp, ci, heure_debut, heure_fin FROM {} "
+                "WHERE tsrange(heure_debut, heure_fin, '[)') && tsrange(%s, %s, '[)')"
+            ).format(sql.Identifier(TABLE_NAME)),
+            (day_start, day_start + timedelta(days=1))
+        )
+        rows = cursor.fetchall()
+    conn.commit()
+    return rows
+
+
+def get_day_windows(day):
+    """Return the cached windows of a day, reading them from Database1 when missing or stale."""
+    with day_windows_lock:
+        cached = day_windows.get(day)
+        if cached is not None and time.monotonic() - cached.loaded_at < QUERY_CACHE_TTL:
+            return cached
+        database_name, db_params = databases[0]
+        conn = get_connection(database_name, db_params)
+        if conn is None:
+            if cached is not None:
+                logging.warning(f"{database_name} unreachable, using the windows loaded before.")
+            return cached
+        try:
+            cached = day_windows[day] = DayWindows(day, fetch_day_windows(conn, day))
+        finally:
+            release_connection(database_name, conn)
+        logging.info(f"Load shedding windows of {day} cached: {len(cached.by_cp)} CP, {len(cached.by_ci)} CI.")
+        return cached
+
+
+def clear_cache():
+    """Forget the cached windows, e.g. after an import."""
+    with day_windows_lock:
+        day_windows.clear()
+
+
+def is_under_load_shedding(cp=None, ci=None, at=None):
+    """Return whether a postal code (cp) or INSEE code (ci) is under load shedding at a time.
+
+    at defaults to now. Codes are zero padded like in the table. Raises
+    ConnectionError when the windows of the day cannot be read.
+    """
+    at = at or datetime.now()
+    windows = get_day_windows(at.date())
+    if windows is None:
+        raise ConnectionError(f"Unable to read the load shedding windows of {at.date()}.")
+    for code, by_code in ((cp, windows.by_cp), (ci, windows.by_ci)):
+        code_windows = by_code.get(str(code).zfill(5)) if code is not None else None
+        if code_windows is not None and code_windows.covers(at):
+            return True
+    return False
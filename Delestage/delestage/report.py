@@ -0,0 +1,260 @@
+import csv
+import gzip
+import logging
+import os
+import re
+import threading
+from collections import Counter
+from delestage.config import BATCH_SIZE, LOAD_METHOD, RELOAD_MODE, REPORT_SAMPLE_SIZE
+
+# Set up summary report configuration
+summary_report_directory = 'summary_reports'
+
+
+def summary_report_path(dynamic_id):
+    """Return the path of the summary report of a ticket."""
+    summary_report_filename = f"{dynamic_id}_summary_report.csv"
+    return os.path.join(summary_report_directory, summary_report_filename)
+
+
+def details_path(dynamic_id):
+    """Return the path of the compressed per-row details of a ticket."""
+    return os.path.join(summary_report_directory, f"{dynamic_id}_details.csv.gz")
+
+
+def pending_path(dynamic_id):
+    """Return the path of the rows loaded but not yet committed of a ticket, see ReportWriter."""
+    return os.path.join(summary_report_directory, f"{dynamic_id}_pending.csv.gz")
+
+
+def error_class(message):
+    """Group error messages by their first line, without the values quoted after ' - '."""
+    return message.strip().split('\n')[0].split(' - ')[0][:120]
+
+
+class ReportWriter:
+    """Collect the outcome of every row of a file for its summary report.
+
+    Every row is streamed to a gzip CSV details file. Only counters, the
+    error classes and the first REPORT_SAMPLE_SIZE rows of each kind are
+    kept in memory. Rows loaded are only known to be inserted once the
+    load is committed, they are kept in a pending gzip file until then, see
+    settle_loaded. Safe to use from the loading threads.
+    """
+
+    def __init__(self, dynamic_id):
+        self.details_path = details_path(dynamic_id)
+        self.pending_path = pending_path(dynamic_id)
+        self.pending_file = None
+        self.details_file = gzip.open(self.details_path, 'wt', newline='')
+        self.details = csv.writer(self.details_file, delimiter=';')
+        self.details.writerow(['kind', 'database', 'cp', 'ci', 'heure_debut', 'heure_fin', 'message'])
+        self.lock = threading.Lock()
+        self.counts = Counter()
+        self.samples = {'inserted': [], 'rolled back': [], 'error': [], 'skipped': []}
+        self.error_classes = Counter()
+
+    def record(self, kind, sample, fields):
+        with self.lock:
+            self.details.writerow([kind] + fields)
+            self.counts[kind] += 1
+            if len(self.samples[kind]) < REPORT_SAMPLE_SIZE:
+                self.samples[kind].append(sample)
+            if kind in ('error', 'skipped'):
+                self.error_classes[error_class(fields[-1])] += 1
+
+    def add_loaded(self, rows):
+        """Record rows loaded into Database1, pending until settle_loaded."""
+        with self.lock:
+            if self.pending_file is None:
+                self.pending_file = gzip.open(self.pending_path, 'wt', newline='')
+                self.pending = csv.writer(self.pending_file, delimiter=';')
+            self.pending.writerows(rows)
+
+    def settle_loaded(self, committed):
+        """Record the pending rows as inserted when Database1 was committed, as rolled back otherwise."""
+        if self.pending_file is None:
+            return
+        self.pending_file.close()
+        self.pending_file = None
+        kind = 'inserted' if committed else 'rolled back'
+        with gzip.open(self.pending_path, 'rt', newline='') as pending_file:
+            for cp, ci, heure_debut, heure_fin in csv.reader(pending_file, delimiter=';'):
+                self.record(
+                    kind,
+                    f"CP: {cp}, CI: {ci}, Heure début: {heure_debut}, Heure fin: {heure_fin}",
+                    ['Database1', cp, ci, heure_debut, heure_fin, '']
+                )
+        os.remove(self.pending_path)
+
+    def add_error(self, database, error_record):
+        """Record an insertion error of a database."""
+        self.record(
+            'error',
+            f"Database: {database}, CP: {error_record['cp']}, CI: {error_record['ci']}, "
+            f"Error: {error_record['error_message']}",
+            [database, error_record['cp'], error_record['ci'], '', '', error_record['error_message']]
+        )
+
+    def add_skipped_lines(self, skipped_lines_log_file_path):
+        """Record the descriptions of the lines skipped by the validation."""
+        if not os.path.exists(skipped_lines_log_file_path):
+            return
+        with open(skipped_lines_log_file_path, 'r') as skipped_lines_log_file:
+            for description in skipped_lines_log_file:
+                description = description.rstrip('\n')
+                self.record('skipped', description, ['', '', '', '', '', description])
+
+    def error_sink(self, database):
+        """Return the insertion errors collector of a database, see ErrorSink."""
+        return ErrorSink(self, database)
+
+    def close(self):
+        if self.pending_file is not None:
+            # The load did not finish, its rows are not reported
+            self.pending_file.close()
+            self.pending_file = None
+            os.remove(self.pending_path)
+        self.details_file.close()
+
+
+class ErrorSink:
+    """List-like collector of the insertion errors of one database, recorded in its report."""
+
+    def __init__(self, report_writer, database):
+        self.report_writer = report_writer
+        self.database = database
+        self.count = 0
+
+    def append(self, error_record):
+        self.count += 1
+        self.report_writer.add_error(self.database, error_record)
+
+    def __len__(self):
+        return self.count
+
+
+def collect_results(results):
+    """Return the successful insertions and the insertion errors counts of a load.
+
+    Database1 is the reference for the successful insertions. Errors of
+    every database are counted, including those of the run a load resumed
+    from, and a database that was rolled back, or that failed after
+    committing part of the data, counts as one error. A load that did not
+    run has no results.
+    """
+    insertion_errors_count = 0
+    for result in results:
+        if not result['committed']:
+            result['errors'].append(
+                {'cp': '*', 'ci': '*', 'error_message': 'Data rolled back, nothing was loaded'}
+            )
+        elif result['failed']:
+            result['errors'].append(
+                {'cp': '*', 'ci': '*', 'error_message': 'Load interrupted, only part of the data was loaded'}
+            )
+        insertion_errors_count += len(result['errors']) + result['resumed_errors']
+    successful_insertions_count = results[0]['loaded'] if results and results[0]['committed'] else 0
+    return successful_insertions_count, insertion_errors_count
+
+
+def databases_summary(results):
+    """Describe the outcome of the load on each database."""
+    summary = ""
+    for result in results:
+        rows_per_second = result['loaded'] / result['seconds'] if result['seconds'] else 0
+        summary += (
+            f"{result['database']}: {'committed' if result['committed'] else 'rolled back'}, "
+            f"{result['loaded']} rows loaded, {len(result['errors']) + result['resumed_errors']} errors, "
+            f"{result['seconds']:.2f} seconds ({rows_per_second:.0f} rows/s)\n"
+        )
+        if result['resumed_batches']:
+            summary += (
+                f"{result['database']}: resumed after {result['resumed_batches']} batches committed by a "
+                "previous run, their rows are not listed in the details\n"
+            )
+        if RELOAD_MODE == 'diff':
+            summary += (
+                f"Diff {result['database']}: {result['inserted']} inserted, "
+                f"{result['deleted']} deleted, {result['unchanged']} unchanged\n"
+            )
+    loaded_counts = {(result['committed'], result['loaded']) for result in results}
+    if len(loaded_counts) > 1:
+        summary += "Warning: the databases diverge after this load\n"
+    return summary
+
+
+def build_report(latest_file, report_writer, results, successful_insertions_count, insertion_errors_count,
+                 skipped_lines_count, load_duration, merged_rows_count=0):
+    """Build the individual report of a file.
+
+    The report only quotes samples of the rows and the most frequent error
+    classes, it is posted as is on the ServiceNow ticket. merged_rows_count
+    is the number of valid rows merged into another window of their
+    (cp, ci) before the load.
+    """
+    filename_without_datetime = re.sub(
+        r'\d{8}_\d{6}_', '', latest_file
+    )
+    rows_per_second = (
+        successful_insertions_count / load_duration if load_duration else 0
+    )
+    logging.info(successful_insertions_count)
+    logging.info(insertion_errors_count)
+    logging.info(skipped_lines_count)
+    total_records_count = (
+        successful_insertions_count +
+        insertion_errors_count +
+        skipped_lines_count +
+        merged_rows_count
+    )
+    samples = {kind: "".join(f"{line}\n" for line in lines) for kind, lines in report_writer.samples.items()}
+
+    report_content = (
+        f"Individual Report for File: {filename_without_datetime}\n"
+        f"Total records in the CSV file: {total_records_count}\n"
+        f"Successful insertions: {successful_insertions_count}\n"
+        f"Duplicate or overlapping windows merged: {merged_rows_count}\n"
+        f"Successful insertions details (first {REPORT_SAMPLE_SIZE}):\n"
+        f"{samples['inserted']}"
+        f"Skipped insertions: {skipped_lines_count}\n"
+        f"Skipped lines details (first {REPORT_SAMPLE_SIZE}):\n"
+        f"{samples['skipped']}"
+        f"Insertions in error: {insertion_errors_count}\n"
+        f"Load method: {LOAD_METHOD} (batch size: {BATCH_SIZE})\n"
+        f"Load throughput: {rows_per_second:.0f} rows/s "
+        f"({load_duration:.2f} seconds)\n"
+        f"{databases_summary(results)}\n"
+    )
+
+    if report_writer.error_classes:
+        report_content += "Top error classes:\n"
+        for message, count in report_writer.error_classes.most_common(5):
+            report_content += f"{count} x {message}\n"
+    if insertion_errors_count:
+        report_content += f"Errors details (first {REPORT_SAMPLE_SIZE}):\n{samples['error']}"
+    report_content += f"All rows details: {report_writer.details_path}\n"
+    return report_content
+
+
+def file_status(successful_count, insertion_errors_count, skipped_lines_count):
+    """Return the final status of a file."""
+    if successful_count < 1:
+        return "KO"
+    elif insertion_errors_count or skipped_lines_count > 0:
+        return "PARTIAL KO"
+    return "OK"
+
+
+def write_final_status(summary_report_path, status, start_time, end_time):
+    """Append the final status and the execution times to a summary report."""
+    duration = end_time - start_time
+
+    with open(summary_report_path, "a") as summary_report_file:
+        summary_report_file.write(
+            f"!!!!!!!!!!!!!!!!Final Status: {status} "
+            "!!!!!!!!!!!!!!!!!!!!!!!!!!!!\n"
+            f"Execution Start Time: {start_time}\n"
+            f"Execution End Time: {end_time}\n"
+            f"Duration: {duration}\n"
+        )
@@ -0,0 +1,53 @@
+import logging
+import psycopg2
+from psycopg2 import sql
+
+TABLE_NAME = 'cp_insee_delestage'
+
+# Timestamps are local times without time zone, like in the ticket files
+CREATE_TABLE = """
+    CREATE TABLE IF NOT EXISTS {} (
+        cp VARCHAR(5) NOT NULL,
+        ci VARCHAR(5) NOT NULL,
+        heure_debut TIMESTAMP NOT NULL,
+        heure_fin TIMESTAMP NOT NULL,
+        date_heure_maj TIMESTAMP
+    )
+"""
+
+# Name suffix and definition of the indexes of the table. Windows are
+# half-open, [heure_debut, heure_fin), the GiST index answers
+# "tsrange(heure_debut, heure_fin) @> timestamp" and overlap queries.
+INDEXES = [
+    ('cp_idx', "USING btree (cp)"),
+    ('ci_idx', "USING btree (ci)"),
+    ('window_idx', "USING gist (tsrange(heure_debut, heure_fin, '[)'))"),
+]
+
+
+def index_names(table=TABLE_NAME):
+    return [f"{table}_{suffix}" for suffix, definition in INDEXES]
+
+
+def create_table(conn):
+    """Create the table and its indexes if they do not exist yet."""
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute(sql.SQL(CREATE_TABLE).format(sql.Identifier(TABLE_NAME)))
+            create_indexes(cursor)
+        conn.commit()
+        return True
+    except psycopg2.Error as e:
+        conn.rollback()
+        logging.error(f"Error creating the table {TABLE_NAME}: {e}")
+        return False
+
+
+def create_indexes(cursor, table=TABLE_NAME):
+    """Create the missing indexes of the table, in the current transaction."""
+    for (suffix, definition), index_name in zip(INDEXES, index_names(table)):
+        cursor.execute(
+            sql.SQL("CREATE INDEX IF NOT EXISTS {} ON {} " + definition).format(
+                sql.Identifier(index_name), sql.Identifier(table)
+            )
+        )
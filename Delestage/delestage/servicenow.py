@@ -0,0 +1,227 @@
+import hashlib
+import json
+import logging
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from delestage.config import (
+    SERVICE_NOW_FLUSH_TIMEOUT, SERVICE_NOW_MAX_ATTEMPTS, SERVICE_NOW_OUTBOX, SERVICE_NOW_PASSWORD,
+    SERVICE_NOW_RETRY_DELAY, SERVICE_NOW_TIMEOUT, SERVICE_NOW_URL, SERVICE_NOW_USERNAME
+)
+from delestage.metrics import run_metrics
+
+OUTBOX_SCHEMA = """
+    CREATE TABLE IF NOT EXISTS outbox (
+        id INTEGER PRIMARY KEY,
+        idempotency_key TEXT NOT NULL UNIQUE,
+        ticket_id TEXT NOT NULL,
+        payload TEXT NOT NULL,
+        status TEXT NOT NULL DEFAULT 'pending',
+        attempts INTEGER NOT NULL DEFAULT 0,
+        next_attempt_at REAL NOT NULL,
+        lease_until REAL NOT NULL DEFAULT 0,
+        last_error TEXT,
+        created_at REAL NOT NULL
+    )
+"""
+# Seconds a claimed update is reserved for the sender before another one may retry it
+LEASE_SECONDS = 300
+MAX_RETRY_DELAY = 3600
+
+# Background sender of the current process, if started
+outbox_worker = None
+
+
+@contextmanager
+def outbox_connection():
+    """Open the outbox database, committing on success."""
+    conn = sqlite3.connect(SERVICE_NOW_OUTBOX, timeout=30)
+    try:
+        with conn:
+            conn.execute(OUTBOX_SCHEMA)
+            yield conn
+    finally:
+        conn.close()
+
+
+def enqueue_ticket_update(dynamic_id, payload, content_key=None):
+    """Store a ticket update in the outbox.
+
+    An update is stored once per ticket and content_key, or per ticket and
+    payload when content_key is not given. Returns whether it was added.
+    """
+    payload_text = json.dumps(payload, sort_keys=True)
+    key_source = payload_text if content_key is None else content_key
+    idempotency_key = hashlib.sha256(f"{dynamic_id}\n{key_source}".encode()).hexdigest()
+    with outbox_connection() as conn:
+        cursor = conn.execute(
+            "INSERT OR IGNORE INTO outbox (idempotency_key, ticket_id, payload, next_attempt_at, created_at) "
+            "VALUES (?, ?, ?, ?, ?)",
+            (idempotency_key, dynamic_id, payload_text, time.time(), time.time())
+        )
+    return cursor.rowcount == 1
+
+
+def claim_due_updates(limit=50):
+    """Reserve the updates due for sending, returns (id, ticket id, payload, attempts) rows."""
+    now = time.time()
+    claimed = []
+    with outbox_connection() as conn:
+        rows = conn.execute(
+            "SELECT id, ticket_id, payload, attempts FROM outbox "
+            "WHERE status = 'pending' AND next_attempt_at <= ? AND lease_until <= ? "
+            "ORDER BY id LIMIT ?",
+            (now, now, limit)
+        ).fetchall()
+        for row in rows:
+            cursor = conn.execute(
+                "UPDATE outbox SET lease_until = ? WHERE id = ? AND lease_until <= ?",
+                (now + LEASE_SECONDS, row[0], now)
+            )
+            if cursor.rowcount == 1:
+                claimed.append(row)
+    return claimed
+
+
+def record_attempt(update_id, dynamic_id, attempts, error, retryable):
+    """Mark an update as sent, or schedule its retry, or give up on it."""
+    with outbox_connection() as conn:
+        if error is None:
+            conn.execute(
+                "UPDATE outbox SET status = 'sent', attempts = ?, last_error = NULL WHERE id = ?",
+                (attempts, update_id)
+            )
+            logging.info(f"Ticket {dynamic_id} closed successfully on ServiceNow.")
+        elif retryable and attempts < SERVICE_NOW_MAX_ATTEMPTS:
+            delay = min(SERVICE_NOW_RETRY_DELAY * 2 ** (attempts - 1), MAX_RETRY_DELAY)
+            conn.execute(
+                "UPDATE outbox SET attempts = ?, last_error = ?, next_attempt_at = ?, lease_until = 0 WHERE id = ?",
+                (attempts, error, time.time() + delay, update_id)
+            )
+            logging.warning(
+                f"Failed to close ticket {dynamic_id} on ServiceNow, retrying in {delay:.0f} seconds. {error}"
+            )
+        else:
+            conn.execute(
+                "UPDATE outbox SET status = 'failed', attempts = ?, last_error = ? WHERE id = ?",
+                (attempts, error, update_id)
+            )
+            logging.error(f"Failed to close ticket {dynamic_id} on ServiceNow. {error}")
+
+
+def new_session():
+    """Return an HTTP session to ServiceNow, reused for keep-alive."""
+    import requests
+
+    session = requests.Session()
+    session.auth = (SERVICE_NOW_USERNAME, SERVICE_NOW_PASSWORD)
+    session.headers.update({
+        "Accept": "application/json",
+        "Content-Type": "application/json"
+    })
+    return session
+
+
+def send_ticket_update(session, dynamic_id, payload):
+    """Send one ticket update to ServiceNow.
+
+    Returns None on success, otherwise the error and whether it is worth
+    retrying (network errors, timeouts, 408, 429 and 5xx responses).
+    """
+    import requests
+
+    servicenow_api_url = f"{SERVICE_NOW_URL}/api/now/table/sc_req_item/{dynamic_id}"
+    try:
+        response = session.put(servicenow_api_url, json=payload, timeout=SERVICE_NOW_TIMEOUT)
+    except requests.RequestException as e:
+        return str(e), True
+    if response.status_code == 200:
+        return None, False
+    error = f"Status code: {response.status_code}, Response: {response.text}"
+    return error, response.status_code in (408, 429) or response.status_code >= 500
+
+
+def drain_outbox(session=None):
+    """Send every update that is due, returns the number sent."""
+    session = session or new_session()
+    sent = 0
+    while True:
+        updates = claim_due_updates()
+        if not updates:
+            return sent
+        for update_id, dynamic_id, payload, attempts in updates:
+            with run_metrics.span('servicenow_call'):
+                error, retryable = send_ticket_update(session, dynamic_id, json.loads(payload))
+            record_attempt(update_id, dynamic_id, attempts + 1, error, retryable)
+            sent += error is None
+
+
+class OutboxWorker(threading.Thread):
+    """Background thread sending the outbox updates over one keep-alive session.
+
+    It wakes up when notified of a new update, or every poll_interval
+    seconds to pick up retries and updates queued by other processes.
+    """
+
+    def __init__(self, poll_interval=2):
+        super().__init__(name='servicenow-outbox', daemon=True)
+        self.poll_interval = poll_interval
+        self.wake_up = threading.Event()
+        self.stopping = False
+
+    def run(self):
+        session = new_session()
+        while True:
+            try:
+                drain_outbox(session)
+            except sqlite3.Error as e:
+                logging.error(f"Error reading the ServiceNow outbox: {e}")
+            if self.stopping:
+                return
+            self.wake_up.wait(self.poll_interval)
+            self.wake_up.clear()
+
+    def stop(self, timeout=SERVICE_NOW_FLUSH_TIMEOUT):
+        """Send what is due and stop, updates still pending are kept for the next run."""
+        self.stopping = True
+        self.wake_up.set()
+        self.join(timeout)
+        if self.is_alive():
+            logging.warning("ServiceNow updates still in flight, they will be retried on the next run.")
+
+
+def start_outbox_worker():
+    """Start the background sender of this process."""
+    global outbox_worker
+    outbox_worker = OutboxWorker()
+    outbox_worker.start()
+    return outbox_worker
+
+
+def close_ticket_on_servicenow(dynamic_id, summary_report_path, file_sha256=None, status=None):
+    """Queue the closure of the ticket on ServiceNow with a comment.
+
+    The update is stored in the outbox and sent in the background, so the
+    load does not wait on ServiceNow. The report holds the times of the run,
+    so the closure is queued once per file content (its SHA-256) and final
+    status: rerunning a file with the same outcome does not post its
+    comment twice. Without file_sha256, only an identical report is
+    queued once.
+    """
+    with open(summary_report_path, "r") as summary_report_file:
+        comment_text = summary_report_file.read()
+
+    data = {
+        "state": "6",
+        "comments": comment_text,
+    }
+
+    content_key = None if file_sha256 is None else f"{file_sha256}\n{status}"
+    if enqueue_ticket_update(dynamic_id, data, content_key):
+        logging.info(f"Closure of ticket {dynamic_id} queued for ServiceNow.")
+    else:
+        logging.info(f"Closure of ticket {dynamic_id} was already queued for ServiceNow.")
+    if outbox_worker is not None:
+        outbox_worker.wake_up.set()
+    return True
@@ -0,0 +1,145 @@
+import io
+import logging
+import multiprocessing
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from delestage.config import VALIDATION_SHARD_SIZE, VALIDATION_WORKERS, WORKERS
+from delestage.validation import SkippedLines, check_header, iter_valid_rows, validate_line
+
+
+def shard_ranges(file_path, shard_size):
+    """Split the data lines of a file into (start, end) byte ranges of about shard_size bytes.
+
+    Every range but the last ends right after a newline, so each line is in
+    exactly one range.
+    """
+    size = os.path.getsize(file_path)
+    ranges = []
+    with open(file_path, 'rb') as data_file:
+        data_file.readline()
+        start = data_file.tell()
+        while start < size:
+            if start + shard_size >= size:
+                end = size
+            else:
+                data_file.seek(start + shard_size - 1)
+                data_file.readline()
+                end = data_file.tell()
+            ranges.append((start, end))
+            start = end
+    return ranges
+
+
+def validate_shard(file_path, start, end):
+    """Validate the lines of a byte range of a file, in a worker process.
+
+    Returns the number of lines read, the valid rows and the
+    (line, description) of the skipped lines, both in file order.
+    """
+    with open(file_path, 'rb') as data_file:
+        data_file.seek(start)
+        data = data_file.read(end - start)
+    read = 0
+    rows = []
+    skipped = []
+    # Decoded and split like the lines of a file opened in text mode
+    for line in io.TextIOWrapper(io.BytesIO(data)):
+        read += 1
+        row, description = validate_line(line)
+        if row is not None:
+            rows.append(row)
+        else:
+            skipped.append((line, description))
+    return read, rows, skipped
+
+
+def validation_workers():
+    """Return the number of validation processes of a loading process.
+
+    0 in the configuration shares the CPUs among the [Import] workers, so
+    that files loaded in parallel do not each start one process per CPU.
+    """
+    return VALIDATION_WORKERS or max(1, (os.cpu_count() or 1) // WORKERS)
+
+
+# Validation processes of this process, started for its first sharded file, see validation_pool
+executor = None
+
+
+def validation_pool():
+    """Return the pool of validation processes, shared by the files this process validates.
+
+    Watch mode and the [Import] workers validate one file after another,
+    the processes are started once instead of once per file.
+    """
+    global executor
+    if executor is None:
+        executor = ProcessPoolExecutor(
+            max_workers=validation_workers(), mp_context=multiprocessing.get_context('spawn')
+        )
+    return executor
+
+
+def shutdown_validation_pool():
+    """Stop the validation processes, the next sharded file starts new ones."""
+    global executor
+    if executor is not None:
+        executor.shutdown(cancel_futures=True)
+        executor = None
+
+
+def iter_sharded_rows(file_path, stats):
+    """Read, validate and normalize a delestage file in parallel worker processes.
+
+    Same contract as validation.iter_valid_rows: yields the same rows and
+    writes the same skipped lines, in file order. The data lines are split
+    into line-aligned byte ranges of VALIDATION_SHARD_SIZE bytes, validated
+    by the spawned processes of validation_pool. Only a few ranges are
+    validated ahead of the rows consumed, so memory use stays bounded.
+    Files of a single range, or a single worker, are read by
+    iter_valid_rows.
+    """
+    workers = validation_workers()
+    ranges = shard_ranges(file_path, VALIDATION_SHARD_SIZE) if workers > 1 else []
+    if len(ranges) < 2:
+        yield from iter_valid_rows(file_path, stats)
+        return
+
+    snow_id = os.path.splitext(os.path.basename(file_path))[0].split('_')[0]
+    stats.update(read=0, valid=0, skipped=0)
+    skipped_lines = SkippedLines(snow_id)
+
+    if not check_header(file_path):
+        return
+    workers = min(workers, len(ranges))
+    pool = validation_pool()
+    pending = deque()
+    try:
+        ranges = iter(ranges)
+        while True:
+            for start, end in ranges:
+                pending.append(pool.submit(validate_shard, file_path, start, end))
+                if len(pending) >= 2 * workers:
+                    break
+            if not pending:
+                break
+            read, rows, skipped = pending.popleft().result()
+            stats['read'] += read
+            stats['valid'] += len(rows)
+            stats['skipped'] += len(skipped)
+            for line, description in skipped:
+                skipped_lines.write(line, description)
+            yield from rows
+    except BrokenProcessPool:
+        shutdown_validation_pool()
+        raise
+    finally:
+        # The ranges of a file left unread must not hold up the next one
+        for future in pending:
+            future.cancel()
+        skipped_lines.close()
+    logging.info(
+        f"Validated {file_path}: {stats['valid']} valid lines, {stats['skipped']} skipped lines."
+    )
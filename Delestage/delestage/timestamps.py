@@ -0,0 +1,24 @@
+from datetime import datetime
+from functools import lru_cache
+
+TIMESTAMP_FORMAT = '%d/%m/%Y %H:%M'
+
+
+@lru_cache(maxsize=4096)
+def parse_timestamp(value):
+    """Parse a 'dd/mm/YYYY HH:MM' timestamp into a datetime.
+
+    The fixed layout is sliced and converted with int() instead of going
+    through strptime. Other layouts strptime accepts, such as single digit
+    days, fall back to strptime. Results are cached since the same few
+    heure_debut/heure_fin values repeat across a file. Raises ValueError
+    for invalid values, like strptime.
+    """
+    if (
+        len(value) == 16 and value[2] == '/' and value[5] == '/' and value[10] == ' ' and value[13] == ':'
+        and (value[0:2] + value[3:5] + value[6:10] + value[11:13] + value[14:16]).isdigit()
+    ):
+        return datetime(
+            int(value[6:10]), int(value[3:5]), int(value[0:2]), int(value[11:13]), int(value[14:16])
+        )
+    return datetime.strptime(value, TIMESTAMP_FORMAT)
@@ -0,0 +1,170 @@
+import logging
+import os
+from delestage.timestamps import parse_timestamp
+
+HEADER = "Depart;Commune;cp;ci;heure_debut;heure_fin"
+
+
+def format_cp_ci(cp, ci):
+    """Format CP and CI to have a length of 5 digits."""
+    cp = cp.zfill(5)
+    ci = ci.zfill(5)
+    return cp, ci
+
+
+def skipped_lines_paths(snow_id):
+    """Return the paths of the skipped lines CSV and of its description log."""
+    return f'{snow_id}_delestage-skipped-lines.csv', f'{snow_id}_skipped-lines.log'
+
+
+def check_header(file_path):
+    """Check that the file has the expected header and at least one data line."""
+    with open(file_path, 'r') as file_content:
+        header = file_content.readline().strip()
+        has_data = bool(file_content.readline())
+    if not has_data:
+        logging.error("Error: File is empty.")
+        return False
+    if header != HEADER:
+        logging.error("Error: Invalid file format.")
+        return False
+    return True
+
+
+def validate_line(line):
+    """Validate and normalize one data line.
+
+    Returns the (cp, ci, heure_debut, heure_fin) row, with datetime
+    timestamps, or None and the reason the line is skipped.
+    """
+    fields = line.strip().split(';')
+    if len(fields) < 6:
+        return None, f"Skipped due to insufficient fields - {line}"
+    if len(fields) > 6:
+        return None, f"Skipped due to too many fields - {line}"
+    depart, commune, cp, ci, heure_debut, heure_fin = fields
+    try:
+        start, end = parse_timestamp(heure_debut), parse_timestamp(heure_fin)
+    except ValueError:
+        return None, (
+            f"Skipped due to invalid date-time format - "
+            f"Heure Debut: {heure_debut}, Heure Fin: {heure_fin}"
+        )
+    if not (cp and ci):
+        return None, (
+            f"Skipped due to missing mandatory fields - "
+            f"CP: {cp or '[CP]'}, CI: {ci or '[CI]'}, "
+            f"Heure Debut: {heure_debut or '[Heure Debut]'}, "
+            f"Heure Fin: {heure_fin or '[Heure Fin]'}"
+        )
+    if end < start:
+        return None, (
+            f"Skipped due to end before start - "
+            f"Heure Debut: {heure_debut}, Heure Fin: {heure_fin}"
+        )
+    cp, ci = format_cp_ci(cp, ci)
+    return (cp, ci, start, end), None
+
+
+class SkippedLines:
+    """Writer of the skipped lines of a file and of their description.
+
+    Files of a previous run of the same ticket are removed, as they would be
+    mistaken for this run's, and new ones are only created for the first
+    skipped line.
+    """
+
+    def __init__(self, snow_id):
+        self.skipped_lines_filename, self.skipped_lines_log_filename = skipped_lines_paths(snow_id)
+        for path in (self.skipped_lines_filename, self.skipped_lines_log_filename):
+            if os.path.exists(path):
+                os.remove(path)
+        self.skipped_file = None
+        self.skipped_lines_log_file = None
+
+    def write(self, line, description):
+        if self.skipped_file is None:
+            self.skipped_file = open(self.skipped_lines_filename, 'w')
+            self.skipped_file.write(HEADER + '\n')
+            self.skipped_lines_log_file = open(self.skipped_lines_log_filename, 'w')
+        self.skipped_file.write(line if line.endswith('\n') else line + '\n')
+        self.skipped_lines_log_file.write(description + '\n')
+
+    def close(self):
+        if self.skipped_file is not None:
+            self.skipped_file.close()
+            self.skipped_lines_log_file.close()
+
+
+def iter_valid_rows(file_path, stats):
+    """Read, validate and normalize a delestage file line by line.
+
+    Yields the valid (cp, ci, heure_debut, heure_fin) rows while writing the
+    skipped lines and their description to the skipped lines files as they
+    are met, so memory use does not depend on the file size. stats is
+    filled with the number of lines read, valid and skipped.
+    """
+    snow_id = os.path.splitext(os.path.basename(file_path))[0].split('_')[0]
+    stats.update(read=0, valid=0, skipped=0)
+    skipped_lines = SkippedLines(snow_id)
+
+    if not check_header(file_path):
+        return
+    try:
+        with open(file_path, 'r') as file_content:
+            file_content.readline()
+            for line in file_content:
+                stats['read'] += 1
+                row, description = validate_line(line)
+                if row is not None:
+                    stats['valid'] += 1
+                    yield row
+                    continue
+                stats['skipped'] += 1
+                skipped_lines.write(line, description)
+    finally:
+        skipped_lines.close()
+    logging.info(
+        f"Validated {file_path}: {stats['valid']} valid lines, {stats['skipped']} skipped lines."
+    )
+
+
+def sweep_windows(rows, overlapping=True):
+    """Merge sorted (cp, ci, heure_debut, heure_fin, payload) rows, once per (cp, ci).
+
+    With overlapping, the current window is extended while the next one
+    starts before or when it ends, otherwise only identical windows are
+    merged. Yields each (cp, ci, heure_debut, heure_fin) window with the
+    payloads of the rows merged into it.
+    """
+    current = None
+    payloads = []
+    for cp, ci, heure_debut, heure_fin, payload in rows:
+        if current is not None and current[0] == cp and current[1] == ci and (
+            heure_debut <= current[3] if overlapping else (heure_debut, heure_fin) == (current[2], current[3])
+        ):
+            if heure_fin > current[3]:
+                current[3] = heure_fin
+            payloads.append(payload)
+            continue
+        if current is not None:
+            yield tuple(current), payloads
+        current = [cp, ci, heure_debut, heure_fin]
+        payloads = [payload]
+    if current is not None:
+        yield tuple(current), payloads
+
+
+def merge_windows(rows, stats):
+    """Merge the duplicate, overlapping and adjacent windows of each (cp, ci).
+
+    Files repeat a (cp, ci) once per Depart/Commune. Rows are sorted, then
+    swept once per (cp, ci), see sweep_windows. Returns the merged rows,
+    sorted, and sets stats['merged'] to the number of rows collapsed.
+    """
+    rows = sorted(rows)
+    merged_rows = [window for window, payloads in sweep_windows(row + (None,) for row in rows)]
+    stats['merged'] = len(rows) - len(merged_rows)
+    if stats['merged']:
+        logging.info(f"Merged {stats['merged']} duplicate or overlapping windows into {len(merged_rows)} rows.")
+    return merged_rows
@@ -0,0 +1,227 @@
+import ctypes
+import ctypes.util
+import logging
+import os
+import queue
+import re
+import select
+import signal
+import struct
+import threading
+import time
+from datetime import datetime
+from delestage.config import (
+    DATA_DIRECTORY, WATCH_INOTIFY, WATCH_POLL_INTERVAL, WATCH_RETRY_DELAY, WATCH_SETTLE_SECONDS
+)
+from delestage.db import close_pools
+from delestage.metrics import run_metrics, write_run_metrics
+from delestage.pipeline import prepare_directories, process_file
+from delestage.precheck import filename_pattern
+from delestage.servicenow import start_outbox_worker
+
+# inotify(7) event masks
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_Q_OVERFLOW = 0x00004000
+IN_CLOEXEC = 0o2000000
+INOTIFY_EVENT = struct.Struct('iIII')
+
+
+class InotifyWatcher:
+    """Report the files closed after writing, or moved into a directory, with inotify.
+
+    A file is complete once its writer closes it, or when it is renamed
+    into the directory after being written elsewhere.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        self.fd = libc.inotify_init1(IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        if libc.inotify_add_watch(self.fd, os.fsencode(directory), IN_CLOSE_WRITE | IN_MOVED_TO) < 0:
+            error = ctypes.get_errno()
+            os.close(self.fd)
+            raise OSError(error, f"inotify_add_watch failed on {directory}")
+
+    def wait(self, timeout):
+        """Return the names of the files completed within timeout seconds."""
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return []
+        buffer = os.read(self.fd, 64 * 1024)
+        names = []
+        offset = 0
+        while offset < len(buffer):
+            wd, mask, cookie, length = INOTIFY_EVENT.unpack_from(buffer, offset)
+            offset += INOTIFY_EVENT.size
+            end = offset + length
+            name = buffer[offset:end].rstrip(b'\0')
+            offset = end
+            if mask & IN_Q_OVERFLOW:
+                # Events were lost, every file of the directory is a candidate again
+                names.extend(os.listdir(self.directory))
+            elif name:
+                names.append(os.fsdecode(name))
+        return names
+
+    def close(self):
+        os.close(self.fd)
+
+
+class PollingWatcher:
+    """Report the files of a directory whose size and modification time stopped changing.
+
+    Used where inotify is not available, e.g. on network file systems.
+    """
+
+    def __init__(self, directory, poll_interval=WATCH_POLL_INTERVAL):
+        self.directory = directory
+        self.poll_interval = poll_interval
+        self.last_seen = {}
+        self.reported = set()
+
+    def wait(self, timeout):
+        """Return the names of the files found complete, scanning at most every poll_interval seconds."""
+        time.sleep(min(timeout, self.poll_interval))
+        seen = {}
+        with os.scandir(self.directory) as entries:
+            for entry in entries:
+                if entry.is_file():
+                    stat = entry.stat()
+                    seen[entry.name] = (stat.st_size, stat.st_mtime_ns)
+        names = [
+            name for name, signature in seen.items()
+            if name not in self.reported and self.last_seen.get(name) == signature
+        ]
+        self.reported.update(names)
+        # A file archived then dropped again under the same name is a new file
+        self.reported.intersection_update(seen)
+        self.last_seen = seen
+        return names
+
+    def close(self):
+        pass
+
+
+def new_watcher(directory):
+    """Return an inotify watcher, or a polling one when inotify is disabled or not available."""
+    if WATCH_INOTIFY:
+        try:
+            return InotifyWatcher(directory)
+        except (OSError, AttributeError) as e:
+            logging.warning(f"inotify not available ({e}), polling {directory} instead.")
+    return PollingWatcher(directory)
+
+
+def watch_directory(watcher, file_queue, stopping, retries):
+    """Queue the ticket files reported by the watcher until stopping is set.
+
+    Files already in the directory at start-up are queued once unchanged
+    for [Watch] settle_seconds, since the watcher only reports new files.
+    The (name, time) pairs put on retries are queued again from that time.
+    """
+    queued = set()
+    # Files queued without a watcher event, by name, with the time from which they may be
+    waiting = {name: 0 for name in os.listdir(watcher.directory) if re.match(filename_pattern, name)}
+    while not stopping.is_set():
+        while True:
+            try:
+                name, retry_at = retries.get_nowait()
+            except queue.Empty:
+                break
+            queued.discard(name)
+            waiting[name] = retry_at
+        now = time.time()
+        for name, queue_at in sorted(waiting.items()):
+            if queue_at > now:
+                continue
+            path = os.path.join(watcher.directory, name)
+            try:
+                settled_at = os.path.getmtime(path) + WATCH_SETTLE_SECONDS
+            except OSError:
+                del waiting[name]
+                continue
+            if settled_at > now:
+                waiting[name] = settled_at
+                continue
+            del waiting[name]
+            if name not in queued:
+                queued.add(name)
+                file_queue.put(path)
+
+        try:
+            names = watcher.wait(1)
+        except OSError as e:
+            logging.error(f"Error watching {watcher.directory}: {e}")
+            time.sleep(WATCH_POLL_INTERVAL)
+            continue
+        # Files are moved to the archive once processed, they can then come back
+        queued.intersection_update(os.listdir(watcher.directory))
+        for name in names:
+            path = os.path.join(watcher.directory, name)
+            if name not in queued and re.match(filename_pattern, name) and os.path.isfile(path):
+                logging.info(f"New file queued: {path}")
+                waiting.pop(name, None)
+                queued.add(name)
+                file_queue.put(path)
+
+
+def run_watch():
+    """Process the ticket files as soon as they land in the data directory, until SIGTERM or Ctrl+C.
+
+    Files are processed one at a time in this process, so the imports, the
+    database connections and the ServiceNow session stay warm between files.
+    A file still in the data directory after its processing, e.g. when
+    Database1 could not be reached, is processed again after [Watch]
+    retry_delay seconds.
+    """
+    prepare_directories()
+    start_time = datetime.now()
+    stopping = threading.Event()
+    signal.signal(signal.SIGTERM, lambda signum, frame: stopping.set())
+
+    watcher = new_watcher(DATA_DIRECTORY)
+    logging.info(f"Watching {DATA_DIRECTORY} with {type(watcher).__name__}.")
+    file_queue = queue.Queue()
+    retries = queue.Queue()
+    watch_thread = threading.Thread(
+        target=watch_directory, args=(watcher, file_queue, stopping, retries), name='delestage-watch', daemon=True
+    )
+    watch_thread.start()
+    outbox_worker = start_outbox_worker()
+    files = {}
+    try:
+        while not stopping.is_set():
+            try:
+                latest_file = file_queue.get(timeout=1)
+            except queue.Empty:
+                continue
+            if not os.path.exists(latest_file):
+                continue
+            try:
+                status, file_metrics = process_file(latest_file, datetime.now().strftime("%Y-%m-%d"))
+            except Exception as e:
+                # The daemon keeps watching, the file stays in the data directory
+                logging.error(f"Error processing {latest_file}: {e}")
+            else:
+                logging.info(f"{latest_file}: {status}")
+                files[latest_file] = status
+                run_metrics.merge(file_metrics)
+                write_run_metrics(start_time, files)
+            if os.path.exists(latest_file):
+                # Processed files are archived, this one did not go through
+                logging.warning(f"{latest_file} was not processed, retrying in {WATCH_RETRY_DELAY:.0f} seconds.")
+                retries.put((os.path.basename(latest_file), time.time() + WATCH_RETRY_DELAY))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        logging.info("Stopping the watch.")
+        stopping.set()
+        watch_thread.join()
+        watcher.close()
+        close_pools()
+        with run_metrics.span('servicenow_flush'):
+            outbox_worker.stop()
+    return files
@@ -0,0 +1,169 @@
+import os
+import queue
+import tempfile
+import unittest
+from unittest import mock
+from delestage import checkpoint, loader
+
+
+class FakeCursor:
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+    def execute(self, query, parameters=None):
+        if query == "SELECT txid_current()":
+            self.conn.txid += 1
+            self.answer = self.conn.txid
+        elif query == "SELECT txid_status(%s)":
+            self.answer = self.conn.transactions.get(parameters[0])
+        else:
+            self.answer = self.conn.row_count
+
+    def fetchone(self):
+        return (self.answer,)
+
+
+class FakeConnection:
+    """Connection to a table holding row_count rows, where transactions have the given status."""
+
+    def __init__(self, row_count, transactions=None):
+        self.row_count = row_count
+        self.transactions = transactions or {}
+        self.txid = 0
+        self.commits = 0
+
+    def cursor(self, *args, **kwargs):
+        return FakeCursor(self)
+
+    def commit(self):
+        self.commits += 1
+
+    def rollback(self):
+        pass
+
+
+class CheckpointTest(unittest.TestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        patcher = mock.patch.object(checkpoint, 'CHECKPOINT_DIRECTORY', os.path.join(directory.name, 'checkpoints'))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.file_path = os.path.join(directory.name, 'ticket_2024-02-01.csv')
+        with open(self.file_path, 'w') as data_file:
+            data_file.write("Depart;Commune;cp;ci;heure_debut;heure_fin\n")
+
+    def interrupted_load(self):
+        """Record two committed batches of a load, in transactions 1 and 2, then a third one that crashed
+        during the commit of transaction 3."""
+        state = checkpoint.Checkpoint(self.file_path, 'ticket')
+        conn = FakeConnection(0)
+        self.assertIsNone(state.resume('Database1', conn, 'table'))
+        state.prepare('Database1', conn, 1, 5000, 0)
+        state.commit('Database1')
+        state.prepare('Database1', conn, 2, 4998, 2)
+        state.commit('Database1')
+        state.prepare('Database1', conn, 3, 100, 0)
+
+    def test_resumes_after_the_last_committed_batch(self):
+        self.interrupted_load()
+        conn = FakeConnection(9998, {3: 'aborted'})
+        target = checkpoint.Checkpoint(self.file_path, 'ticket').resume('Database1', conn, 'table')
+        self.assertEqual((target['batches'], target['loaded'], target['errors']), (2, 9998, 2))
+
+    def test_pending_batch_committed_by_the_database_counts_as_committed(self):
+        self.interrupted_load()
+        conn = FakeConnection(10098, {3: 'committed'})
+        target = checkpoint.Checkpoint(self.file_path, 'ticket').resume('Database1', conn, 'table')
+        self.assertEqual((target['batches'], target['loaded'], target['errors']), (3, 10098, 2))
+
+    def test_starts_over_when_the_pending_batch_outcome_is_unknown(self):
+        self.interrupted_load()
+        state = checkpoint.Checkpoint(self.file_path, 'ticket')
+        self.assertIsNone(state.resume('Database1', FakeConnection(10098), 'table'))
+
+    def test_starts_over_when_the_first_batch_did_not_commit(self):
+        # In delete mode, the previous rows may number as many as the first batch
+        state = checkpoint.Checkpoint(self.file_path, 'ticket')
+        conn = FakeConnection(5000)
+        self.assertIsNone(state.resume('Database1', conn, 'table'))
+        state.prepare('Database1', conn, 1, 5000, 0)
+        conn = FakeConnection(5000, {1: 'aborted'})
+        self.assertIsNone(checkpoint.Checkpoint(self.file_path, 'ticket').resume('Database1', conn, 'table'))
+
+    def test_starts_over_when_the_table_does_not_match(self):
+        self.interrupted_load()
+        state = checkpoint.Checkpoint(self.file_path, 'ticket')
+        self.assertIsNone(state.resume('Database1', FakeConnection(42, {3: 'aborted'}), 'table'))
+
+    def test_starts_over_for_another_file_content(self):
+        self.interrupted_load()
+        with open(self.file_path, 'a') as data_file:
+            data_file.write("D;C;7500;75100;01/02/2024 08:00;01/02/2024 10:00\n")
+        state = checkpoint.Checkpoint(self.file_path, 'ticket')
+        self.assertIsNone(state.resume('Database1', FakeConnection(9998, {3: 'aborted'}), 'table'))
+
+    def test_starts_over_with_other_settings(self):
+        self.interrupted_load()
+        with mock.patch.object(checkpoint, 'BATCH_SIZE', checkpoint.BATCH_SIZE + 1):
+            state = checkpoint.Checkpoint(self.file_path, 'ticket')
+        self.assertIsNone(state.resume('Database1', FakeConnection(9998, {3: 'aborted'}), 'table'))
+
+    def test_other_databases_resume_on_their_own(self):
+        self.interrupted_load()
+        state = checkpoint.Checkpoint(self.file_path, 'ticket')
+        self.assertIsNone(state.resume('Database2', FakeConnection(9998, {3: 'aborted'}), 'table'))
+
+    def test_load_skips_the_committed_batches(self):
+        self.interrupted_load()
+        inserted_batches = []
+        batch_queue = queue.Queue()
+        for batch in (['row1'] * 5000, ['row2'] * 5000, ['row3'] * 100):
+            batch_queue.put(batch)
+        batch_queue.put(None)
+        with mock.patch.object(loader, 'LOAD_METHOD', 'bulk'), \
+                mock.patch.object(loader, 'RELOAD_MODE', 'delete'), \
+                mock.patch.object(loader, 'create_table', return_value=True), \
+                mock.patch.object(loader, 'insert_batch', lambda conn, batch, errors, table: inserted_batches.append(batch) or batch):
+            result = loader.load_target(
+                'Database1', FakeConnection(9998, {3: 'aborted'}), batch_queue,
+                checkpoint=checkpoint.Checkpoint(self.file_path, 'ticket')
+            )
+        self.assertEqual(inserted_batches, [['row3'] * 100])
+        self.assertFalse(result['failed'])
+        self.assertEqual((result['resumed_batches'], result['loaded'], result['resumed_errors']), (2, 10098, 2))
+
+    def test_committed_batches_of_a_failed_delete_load_are_reported_committed(self):
+        def insert_batch(conn, batch, errors, table):
+            if batch[0] == 'row2':
+                raise loader.psycopg2.OperationalError("connection lost")
+            return batch
+
+        batch_queue = queue.Queue()
+        for batch in (['row1'] * 5000, ['row2'] * 5000):
+            batch_queue.put(batch)
+        batch_queue.put(None)
+        conn = FakeConnection(0)
+        with mock.patch.object(loader, 'LOAD_METHOD', 'bulk'), \
+                mock.patch.object(loader, 'RELOAD_MODE', 'delete'), \
+                mock.patch.object(loader, 'create_table', return_value=True), \
+                mock.patch.object(loader, 'delete_all_rows', return_value=True), \
+                mock.patch.object(loader, 'insert_batch', insert_batch):
+            state = checkpoint.Checkpoint(self.file_path, 'ticket')
+            result = loader.finish_target(conn, loader.load_target('Database1', conn, batch_queue, checkpoint=state), False)
+        self.assertTrue(result['failed'])
+        self.assertTrue(result['committed'])
+        self.assertEqual((result['committed_batches'], result['loaded']), (1, 5000))
+        self.assertEqual(state.state['targets']['Database1']['batches'], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
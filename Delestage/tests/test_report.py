@@ -0,0 +1,48 @@
+import csv
+import gzip
+import os
+import tempfile
+import unittest
+from unittest import mock
+from delestage import report
+
+
+class ReportWriterTest(unittest.TestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        patcher = mock.patch.object(report, 'summary_report_directory', directory.name)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def details(self, report_writer):
+        report_writer.close()
+        with gzip.open(report_writer.details_path, 'rt', newline='') as details_file:
+            return [row[:3] for row in csv.reader(details_file, delimiter=';')][1:]
+
+    def test_committed_rows_are_inserted(self):
+        report_writer = report.ReportWriter('ticket')
+        report_writer.add_loaded([('07500', '75100', 'a', 'b')])
+        report_writer.settle_loaded(True)
+        self.assertEqual(len(report_writer.samples['inserted']), 1)
+        self.assertEqual(self.details(report_writer), [['inserted', 'Database1', '07500']])
+        self.assertFalse(os.path.exists(report_writer.pending_path))
+
+    def test_rolled_back_rows_are_not_inserted(self):
+        report_writer = report.ReportWriter('ticket')
+        report_writer.add_loaded([('07500', '75100', 'a', 'b')])
+        report_writer.settle_loaded(False)
+        self.assertEqual(report_writer.samples['inserted'], [])
+        self.assertEqual(report_writer.error_classes, {})
+        self.assertEqual(self.details(report_writer), [['rolled back', 'Database1', '07500']])
+
+    def test_unsettled_rows_are_not_reported(self):
+        report_writer = report.ReportWriter('ticket')
+        report_writer.add_loaded([('07500', '75100', 'a', 'b')])
+        self.assertEqual(self.details(report_writer), [])
+        self.assertFalse(os.path.exists(report_writer.pending_path))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,120 @@
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+import unittest
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from unittest import mock
+from delestage import servicenow
+
+
+class StubServiceNow(BaseHTTPRequestHandler):
+    """ServiceNow table API answering the status codes of its server, in turn."""
+
+    def do_PUT(self):
+        body = self.rfile.read(int(self.headers['Content-Length']))
+        self.server.requests.append((self.path, json.loads(body)))
+        status_code = self.server.status_codes.pop(0) if self.server.status_codes else 200
+        self.send_response(status_code)
+        self.send_header('Content-Type', 'application/json')
+        self.end_headers()
+        self.wfile.write(b'{}')
+
+    def log_message(self, format, *args):
+        pass
+
+
+class OutboxTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = HTTPServer(('127.0.0.1', 0), StubServiceNow)
+        self.server.requests = []
+        self.server.status_codes = []
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.outbox = os.path.join(directory.name, 'outbox.sqlite3')
+        self.report_path = os.path.join(directory.name, 'report.csv')
+        for name, value in (
+            ('SERVICE_NOW_URL', f"http://127.0.0.1:{self.server.server_port}"),
+            ('SERVICE_NOW_OUTBOX', self.outbox),
+            ('SERVICE_NOW_RETRY_DELAY', 0),
+            ('SERVICE_NOW_MAX_ATTEMPTS', 3),
+            ('SERVICE_NOW_TIMEOUT', 5),
+        ):
+            patcher = mock.patch.object(servicenow, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def write_report(self, text):
+        with open(self.report_path, 'w') as report_file:
+            report_file.write(text)
+
+    def outbox_rows(self):
+        with sqlite3.connect(self.outbox) as conn:
+            return conn.execute("SELECT ticket_id, status, attempts, next_attempt_at FROM outbox ORDER BY id").fetchall()
+
+    def test_closure_is_sent(self):
+        self.write_report("report")
+        servicenow.close_ticket_on_servicenow('ticket', self.report_path, 'sha', 'OK')
+        self.assertEqual(servicenow.drain_outbox(), 1)
+        self.assertEqual(self.server.requests, [
+            ('/api/now/table/sc_req_item/ticket', {'state': '6', 'comments': 'report'})
+        ])
+        self.assertEqual(self.outbox_rows()[0][1:3], ('sent', 1))
+
+    def test_server_errors_are_retried(self):
+        self.server.status_codes = [503, 429]
+        self.write_report("report")
+        servicenow.close_ticket_on_servicenow('ticket', self.report_path, 'sha', 'OK')
+        self.assertEqual(servicenow.drain_outbox(), 1)
+        self.assertEqual(len(self.server.requests), 3)
+        self.assertEqual(self.outbox_rows()[0][1:3], ('sent', 3))
+
+    def test_retry_delay_doubles(self):
+        self.server.status_codes = [500, 500]
+        self.write_report("report")
+        servicenow.close_ticket_on_servicenow('ticket', self.report_path, 'sha', 'OK')
+        with mock.patch.object(servicenow, 'SERVICE_NOW_RETRY_DELAY', 30):
+            before = time.time()
+            self.assertEqual(servicenow.drain_outbox(), 0)
+            self.assertAlmostEqual(self.outbox_rows()[0][3] - before, 30, delta=5)
+            with sqlite3.connect(self.outbox) as conn:
+                conn.execute("UPDATE outbox SET next_attempt_at = 0")
+            before = time.time()
+            self.assertEqual(servicenow.drain_outbox(), 0)
+            self.assertAlmostEqual(self.outbox_rows()[0][3] - before, 60, delta=5)
+        self.assertEqual(self.outbox_rows()[0][1:3], ('pending', 2))
+
+    def test_client_errors_are_not_retried(self):
+        self.server.status_codes = [404]
+        self.write_report("report")
+        servicenow.close_ticket_on_servicenow('ticket', self.report_path, 'sha', 'OK')
+        self.assertEqual(servicenow.drain_outbox(), 0)
+        self.assertEqual(len(self.server.requests), 1)
+        self.assertEqual(self.outbox_rows()[0][1:3], ('failed', 1))
+
+    def test_rerun_of_the_same_file_is_queued_once(self):
+        self.write_report("report, Execution Start Time: 10:00")
+        servicenow.close_ticket_on_servicenow('ticket', self.report_path, 'sha', 'OK')
+        self.write_report("report, Execution Start Time: 11:00")
+        servicenow.close_ticket_on_servicenow('ticket', self.report_path, 'sha', 'OK')
+        self.assertEqual(len(self.outbox_rows()), 1)
+
+    def test_new_outcome_is_queued_again(self):
+        self.write_report("report")
+        servicenow.close_ticket_on_servicenow('ticket', self.report_path, 'sha', 'KO')
+        servicenow.close_ticket_on_servicenow('ticket', self.report_path, 'sha', 'OK')
+        servicenow.close_ticket_on_servicenow('ticket', self.report_path, 'other sha', 'OK')
+        servicenow.close_ticket_on_servicenow('other ticket', self.report_path, 'sha', 'OK')
+        self.assertEqual(len(self.outbox_rows()), 4)
+        self.assertEqual(servicenow.drain_outbox(), 4)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,130 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+from delestage import shards, validation
+
+HEADER = b"Depart;Commune;cp;ci;heure_debut;heure_fin"
+
+
+def data_line(index):
+    return f"D;C;{7500 + index};{75100 + index};01/02/2024 08:00;01/02/2024 10:00".encode()
+
+
+class ShardRangesTest(unittest.TestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.file_path = os.path.join(directory.name, 'ticket_2024-02-01.csv')
+
+    def write(self, content):
+        with open(self.file_path, 'wb') as data_file:
+            data_file.write(content)
+
+    def shard_lines(self, shard_size):
+        """Check that the ranges cover the data lines and end after a newline, return their contents."""
+        ranges = shards.shard_ranges(self.file_path, shard_size)
+        with open(self.file_path, 'rb') as data_file:
+            content = data_file.read()
+        self.assertEqual(ranges[0][0], content.index(b'\n') + 1)
+        self.assertEqual(ranges[-1][1], len(content))
+        for (_, end), (next_start, _) in zip(ranges, ranges[1:]):
+            self.assertEqual(end, next_start)
+            self.assertTrue(content[:end].endswith(b'\n'))
+        return [content[start:end] for start, end in ranges]
+
+    def test_ranges_end_after_a_newline(self):
+        lines = [data_line(index) + b'\n' for index in range(10)]
+        self.write(HEADER + b'\n' + b''.join(lines))
+        shard_contents = self.shard_lines(100)
+        self.assertEqual(b''.join(shard_contents), b''.join(lines))
+        self.assertGreater(len(shard_contents), 1)
+
+    def test_crlf_lines_are_not_split(self):
+        lines = [data_line(index) + b'\r\n' for index in range(10)]
+        self.write(HEADER + b'\r\n' + b''.join(lines))
+        shard_contents = self.shard_lines(100)
+        self.assertEqual(b''.join(shard_contents), b''.join(lines))
+        for shard_content in shard_contents:
+            self.assertTrue(shard_content.endswith(b'\r\n'))
+
+    def test_last_line_without_newline(self):
+        lines = [data_line(index) for index in range(10)]
+        self.write(HEADER + b'\n' + b'\n'.join(lines))
+        shard_contents = self.shard_lines(100)
+        self.assertEqual(shard_contents[-1].splitlines()[-1], lines[-1])
+        self.assertEqual(b''.join(shard_contents), b'\n'.join(lines))
+
+    def test_shards_smaller_than_a_line_hold_one_line_each(self):
+        lines = [data_line(index) + b'\n' for index in range(5)]
+        self.write(HEADER + b'\n' + b''.join(lines))
+        self.assertEqual(self.shard_lines(1), lines)
+
+    def test_header_only(self):
+        self.write(HEADER + b'\n')
+        self.assertEqual(shards.shard_ranges(self.file_path, 100), [])
+
+
+class ValidationWorkersTest(unittest.TestCase):
+
+    def test_cpus_are_shared_among_the_workers(self):
+        with mock.patch.object(shards, 'VALIDATION_WORKERS', 0), mock.patch.object(shards, 'WORKERS', 4), \
+                mock.patch.object(shards.os, 'cpu_count', return_value=8):
+            self.assertEqual(shards.validation_workers(), 2)
+            with mock.patch.object(shards, 'WORKERS', 16):
+                self.assertEqual(shards.validation_workers(), 1)
+
+    def test_configured_number(self):
+        with mock.patch.object(shards, 'VALIDATION_WORKERS', 3), mock.patch.object(shards, 'WORKERS', 4):
+            self.assertEqual(shards.validation_workers(), 3)
+
+
+class ShardedRowsTest(unittest.TestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.file_path = os.path.join(directory.name, 'ticket_2024-02-01.csv')
+        skipped_paths = (os.path.join(directory.name, 'skipped.csv'), os.path.join(directory.name, 'skipped.log'))
+        for patcher in (
+            mock.patch.object(validation, 'skipped_lines_paths', lambda snow_id: skipped_paths),
+            mock.patch.object(shards, 'VALIDATION_SHARD_SIZE', 150),
+            mock.patch.object(shards, 'validation_workers', lambda: 2),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.addCleanup(shards.shutdown_validation_pool)
+        self.skipped_paths = skipped_paths
+
+    def read_file(self, reader):
+        stats = {}
+        rows = list(reader(self.file_path, stats))
+        skipped = []
+        for path in self.skipped_paths:
+            with open(path) as skipped_file:
+                skipped.append(skipped_file.read())
+        return rows, skipped, stats
+
+    def test_same_rows_and_skipped_lines_as_the_line_reader(self):
+        lines = []
+        for index in range(40):
+            if index % 7 == 3:
+                lines.append(b"D;C;;75100;01/02/2024 08:00;01/02/2024 10:00")
+            elif index % 11 == 5:
+                lines.append(f"D;C;{index};75100;bad;01/02/2024 10:00".encode())
+            else:
+                lines.append(data_line(index))
+        with open(self.file_path, 'wb') as data_file:
+            data_file.write(HEADER + b'\r\n' + b'\r\n'.join(lines))
+        self.assertGreater(len(shards.shard_ranges(self.file_path, 150)), 2)
+
+        expected = self.read_file(validation.iter_valid_rows)
+        self.assertEqual(self.read_file(shards.iter_sharded_rows), expected)
+        rows, skipped, stats = expected
+        self.assertEqual((stats['read'], stats['valid'], stats['skipped']), (40, len(rows), 40 - len(rows)))
+        self.assertGreater(stats['skipped'], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
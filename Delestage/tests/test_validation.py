@@ -0,0 +1,83 @@
+import unittest
+from datetime import datetime
+from delestage.batch import merge_ticket_windows
+from delestage.validation import merge_windows
+
+
+def window(cp, ci, start_hour, end_hour):
+    return cp, ci, datetime(2024, 2, 1, start_hour), datetime(2024, 2, 1, end_hour)
+
+
+class MergeWindowsTest(unittest.TestCase):
+
+    def test_duplicates_are_merged(self):
+        stats = {}
+        rows = [window('07500', '75100', 8, 10)] * 3
+        self.assertEqual(merge_windows(rows, stats), [window('07500', '75100', 8, 10)])
+        self.assertEqual(stats['merged'], 2)
+
+    def test_overlapping_and_adjacent_windows_are_merged(self):
+        stats = {}
+        rows = [
+            window('07500', '75100', 12, 14),
+            window('07500', '75100', 8, 10),
+            window('07500', '75100', 9, 11),
+            window('07500', '75100', 11, 12),
+        ]
+        self.assertEqual(merge_windows(rows, stats), [window('07500', '75100', 8, 14)])
+        self.assertEqual(stats['merged'], 3)
+
+    def test_contained_window_keeps_the_longest_end(self):
+        stats = {}
+        rows = [window('07500', '75100', 8, 18), window('07500', '75100', 9, 10)]
+        self.assertEqual(merge_windows(rows, stats), [window('07500', '75100', 8, 18)])
+
+    def test_disjoint_windows_are_kept(self):
+        stats = {}
+        rows = [window('07500', '75100', 14, 16), window('07500', '75100', 8, 10)]
+        self.assertEqual(
+            merge_windows(rows, stats), [window('07500', '75100', 8, 10), window('07500', '75100', 14, 16)]
+        )
+        self.assertEqual(stats['merged'], 0)
+
+    def test_windows_of_other_cp_ci_are_not_merged(self):
+        stats = {}
+        rows = [window('07500', '75100', 8, 10), window('07500', '75101', 8, 10), window('07501', '75100', 9, 11)]
+        self.assertEqual(merge_windows(rows, stats), sorted(rows))
+        self.assertEqual(stats['merged'], 0)
+
+    def test_no_rows(self):
+        stats = {}
+        self.assertEqual(merge_windows([], stats), [])
+        self.assertEqual(stats['merged'], 0)
+
+
+class MergeTicketWindowsTest(unittest.TestCase):
+
+    def test_merged_windows_keep_their_tickets(self):
+        stats = {}
+        ticket_rows = [
+            window('07500', '75100', 8, 10) + ('ticket1',),
+            window('07500', '75100', 9, 12) + ('ticket2',),
+            window('07500', '75100', 14, 16) + ('ticket2',),
+        ]
+        rows, provenance = merge_ticket_windows(ticket_rows, stats)
+        self.assertEqual(rows, [window('07500', '75100', 8, 12), window('07500', '75100', 14, 16)])
+        self.assertEqual(provenance, [{'ticket1', 'ticket2'}, {'ticket2'}])
+        self.assertEqual(stats['merged'], 1)
+
+    def test_only_identical_windows_are_merged_without_overlapping(self):
+        stats = {}
+        ticket_rows = [
+            window('07500', '75100', 8, 10) + ('ticket1',),
+            window('07500', '75100', 8, 10) + ('ticket2',),
+            window('07500', '75100', 9, 12) + ('ticket2',),
+        ]
+        rows, provenance = merge_ticket_windows(ticket_rows, stats, overlapping=False)
+        self.assertEqual(rows, [window('07500', '75100', 8, 10), window('07500', '75100', 9, 12)])
+        self.assertEqual(provenance, [{'ticket1', 'ticket2'}, {'ticket2'}])
+        self.assertEqual(stats['merged'], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()